@@ -0,0 +1,87 @@
+from qiskit import AncillaRegister
+
+
+'''
+Hands out ancilla qubits of one circuit and takes them back once they have
+been uncomputed, so later stages reuse the same qubits instead of each
+adding a fresh register. The pool only grows the circuit when no clean
+qubit is free.
+
+params
+---------------
+circuit: the circuit the ancillas belong to
+name: prefix for the ancilla registers the pool adds
+'''
+class AncillaPool:
+    def __init__(self, circuit, name='pool'):
+        self.circuit = circuit
+        self.name = name
+        self.free = []
+        self.allocated = 0
+        self.in_use = 0
+        self.peak = 0
+        self.registers = 0
+
+    '''
+    params
+    ---------------
+    size: number of clean (|0>) ancillas needed
+
+    return
+    ---------------
+    a list of ancilla qubits, taken from the free list first
+    '''
+    def acquire(self, size):
+        if len(self.free) < size:
+            register = AncillaRegister(size - len(self.free), f'{self.name}{self.registers}')
+            self.circuit.add_register(register)
+            self.registers += 1
+            self.allocated += register.size
+            self.free.extend(register)
+        qubits = self.free[:size]
+        del self.free[:size]
+        self.in_use += size
+        self.peak = max(self.peak, self.in_use)
+        return qubits
+
+    '''
+    params
+    ---------------
+    qubits: ancillas from acquire, which the caller has returned to |0>
+    '''
+    def release(self, qubits):
+        self.free.extend(qubits)
+        self.in_use -= len(qubits)
+
+    '''
+    return
+    ---------------
+    allocated: ancilla qubits added to the circuit
+    peak: most ancillas live at the same time
+    in_use: ancillas acquired and not released (kept as outputs or junk)
+    free: clean ancillas available for reuse
+    '''
+    def report(self):
+        return {'allocated': self.allocated,
+                'peak': self.peak,
+                'in_use': self.in_use,
+                'free': len(self.free)}
+
+
+'''
+params
+---------------
+circuit: the circuit to append to
+start: len(circuit.data) before the gates to undo were added
+stop: len(circuit.data) after them (defaults to the end)
+
+return
+---------------
+nothing; appends the inverse of circuit.data[start:stop] in reverse order,
+which returns any ancillas those gates computed to |0>
+'''
+def uncompute(circuit, start, stop=None):
+    if stop is None:
+        stop = len(circuit.data)
+    for instruction, qargs, cargs in reversed(circuit.data[start:stop]):
+        circuit.append(instruction.inverse(), qargs, cargs)
@@ -0,0 +1,202 @@
+'''
+Reversible arithmetic blocks shared by the steganography builders and the
+templates that cache them: the comparator and the subtractor chain behind
+difference. Registers hold values with qubit 0 the least significant bit,
+as neqr writes intensities. This module imports neither steganography nor
+templates, so both can import it.
+'''
+from qiskit import QuantumRegister, AncillaRegister
+from qiskit.circuit.library import SXdgGate
+
+import ancilla as ancilla_pool
+import instrument
+
+# controlled SXdg, shared by every subtractor instead of being rebuilt per call
+CSXDG_GATE = SXdgGate().control()
+
+'''
+params
+---------------
+regY: a quantum register, qubit 0 the least significant bit
+regX: a quantum register of the same size
+circuit: the circuit that contains all the register
+result: an empty register that will hold results
+pool: optional ancilla.AncillaPool; the comparator's ancillas are then
+uncomputed after the result is copied out and returned to the pool
+
+return
+---------------
+a size 2 register, c0 c1:
+If c1c0 = 00, then Y = X.
+If c1c0 = 01, then Y < X.
+If c1c0 = 10, then Y > X
+'''
+@instrument.stage()
+def comparator(regY, regX, circuit, result, pool=None): 
+    # regX and regY should have the same size 
+    regLength = len(regX)
+    if pool is None:
+        ancilla = AncillaRegister(2*regLength)
+        circuit.add_register(ancilla)
+    else:
+        ancilla = pool.acquire(2*regLength)
+
+    start = len(circuit.data)
+    comparator_core(circuit, regY, regX, ancilla)
+    stop = len(circuit.data)
+
+    # the ladder flags Y > X on ancilla[2*regLength-2] and Y < X on the last
+    circuit.cx(ancilla[2*regLength-2], result[1])
+    circuit.cx(ancilla[2*regLength-1], result[0])
+
+    if pool is not None:
+        ancilla_pool.uncompute(circuit, start, stop)
+        pool.release(ancilla)
+
+
+'''
+params
+---------------
+circuit: the circuit that contains all the registers
+regY: a quantum register
+regX: a quantum register
+ancilla: 2*len(regX) clean ancilla qubits
+
+return
+---------------
+nothing; the last two ancillas hold the comparison that comparator copies
+into its result register
+'''
+def comparator_core(circuit, regY, regX, ancilla):
+    regLength = len(regX)
+    # the ladder runs from the most significant bit, the last qubit
+    regY, regX = regY[::-1], regX[::-1]
+    circuit.x(ancilla)
+    for index in range(regLength):
+        circuit.x(regX[index])
+        circuit.mcx([regY[index], regX[index]]+[ancilla[i] for i in range(2*index)], [ancilla[index*2]])
+        if index < regLength-1: 
+            circuit.mcx([regY[index], regX[index]]+[ancilla[i] for i in range(2*index)], [ancilla[2*regLength-2]])
+        circuit.x(regX[index])
+        circuit.x(regY[index])
+        circuit.mcx([regY[index], regX[index]]+[ancilla[i] for i in range(2*index)], [ancilla[index*2+1]])
+        if index < regLength-1: 
+            circuit.mcx([regY[index], regX[index]]+[ancilla[i] for i in range(2*index)], [ancilla[2*regLength-1]])
+        circuit.x(regY[index])     
+    circuit.x(ancilla)
+
+
+'''
+params
+---------------
+Y: a quantum register, qubit 0 the least significant bit as neqr writes
+intensities
+X: a quantum register of the same size
+difference: an empty quantum register the same size as X and Y
+pool: optional ancilla.AncillaPool to draw the sign and borrow qubits from;
+they stay entangled with the result and are not released
+barriers: separate the subtractor blocks with barriers, for drawing; without
+them the transpiler can cancel and commute gates across blocks
+
+return
+---------------
+A quantum register |D> which holds the positive difference of Y and X.
+'''
+@instrument.stage()
+def difference(circuit, Y, X, difference, pool=None, barriers=True):
+    assert len(Y) == len(X)
+    # PART 1: 
+    # reversible parallel subtractor
+    
+    # the borrow ripples up from the least significant bit, qubit 0; the
+    # subtractor chain below runs from the last qubit, so walk them reversed
+    Y, X, difference = Y[::-1], X[::-1], difference[::-1]
+
+    # initialize registers to store sign, difference, and junk qubits
+    regLength = len(X)
+    if pool is None:
+        sign = QuantumRegister(1)
+        ancilla = QuantumRegister(regLength - 1)
+        circuit.add_register(ancilla)
+        circuit.add_register(sign)
+    else:
+        sign = pool.acquire(1)
+        ancilla = pool.acquire(regLength - 1)
+
+    # perform half subtractor for last qubit; a single bit borrows into the sign
+    borrow = ancilla[-1] if regLength > 1 else sign[0]
+    rev_half_subtractor(circuit, X[-1], Y[-1], difference[-1], borrow, barriers=barriers)
+    
+    # perform full subtrator for rest of qubits
+    for i in range(regLength - 2, 0, -1): 
+        rev_full_subtractor(circuit, X[i], Y[i], ancilla[i], difference[i], ancilla[i-1], barriers=barriers)
+    if regLength > 1:
+        rev_full_subtractor(circuit, X[0], Y[0], ancilla[0], difference[0], sign[0], barriers=barriers)
+    
+    # swap X and difference registers to fix result 
+    # this is just sort of a thing you have to do
+    for i in range(regLength - 1, -1, -1): 
+        circuit.swap(difference[i], X[i])
+    
+    # PART 2: 
+    # complementary operation
+
+    # flip the difference based on the sign (pt 1)
+    for i in range(regLength): 
+        circuit.cx(sign[0], difference[i])
+    
+    # flip the difference again, but based on sign and remaining bits (pt 2)
+    #for i in range(regLength-1, -1, -1):
+    for i in range(regLength):
+        circuit.mcx([sign[0]] + difference[i+1:], difference[i])
+    
+
+
+
+'''
+params
+---------------
+regA: a quantum register, one of the numbers being subtracted
+regB: a quantum register, one of the numbers being subtracted
+Q: Updated depending on result
+Borrow: Digit to be carried over
+barriers: end the block with a barrier, for drawing
+
+return
+---------------
+Performs A - B, and updates results into Q and Borrow 
+'''
+def rev_half_subtractor(circuit, A, B, Q, Borrow, barriers=True): 
+    circuit.append(CSXDG_GATE, [A, Borrow])
+    circuit.cx(A, Q)
+    circuit.cx(B, A)
+    circuit.csx(B, Borrow)
+    circuit.csx(A, Borrow)
+    if barriers:
+        circuit.barrier()
+    
+    
+'''
+params
+---------------
+regA: a quantum register, one of the numbers being subtracted
+regB: a quantum register, one of the numbers subtracting
+regC: a quantum register, one of the numbers subtracting
+Q: Updated depending on result
+Borrow: Digit to be carried over
+barriers: end the block with a barrier, for drawing
+
+return
+---------------
+Performs A - B - C, updates results into Q and Borrow
+'''
+def rev_full_subtractor(circuit, A, B, C, Q, Borrow, barriers=True): 
+    circuit.append(CSXDG_GATE, [A, Borrow])
+    circuit.cx(A, Q)
+    circuit.cx(B, A)
+    circuit.csx(B, Borrow)
+    circuit.cx(C, A)
+    circuit.csx(C, Borrow)
+    circuit.csx(A, Borrow)
+    if barriers:
+        circuit.barrier()
@@ -0,0 +1,126 @@
+'''
+Local backend selection for the steganography pipeline. Small circuits run
+on the Aer statevector method; wider ones (NEQR images plus the comparator
+and subtractor ancillas) run on the Aer matrix product state method, whose
+cost depends on entanglement rather than qubit count. Everything runs
+locally, so no IBMQ account or network access is needed.
+'''
+import math
+
+from qiskit.compiler import transpile
+
+import mcx
+import peephole
+
+# widest circuit simulated with a dense statevector (2^24 amplitudes is 256 MiB)
+STATEVECTOR_MAX_QUBITS = 24
+
+# MPS bond dimension cap and the Schmidt coefficient cutoff below which
+# values are truncated
+MPS_MAX_BOND_DIMENSION = 256
+MPS_TRUNCATION_THRESHOLD = 1e-10
+
+_DIRECTIVES = {'barrier', 'measure', 'delay', 'reset'}
+
+
+'''
+params
+---------------
+circuit: a quantum circuit
+
+return
+---------------
+an upper estimate of log2 of the MPS bond dimension the circuit needs: for
+every cut of the qubit line, the number of multi-qubit gates crossing it,
+capped by the number of qubits on the smaller side of the cut
+'''
+def estimate_entanglement(circuit):
+    n = circuit.num_qubits
+    if n < 2:
+        return 0
+    qubit_index = {qubit: i for i, qubit in enumerate(circuit.qubits)}
+    crossings = [0] * (n - 1)
+    for instruction, qargs, cargs in circuit.data:
+        if len(qargs) < 2 or instruction.name in _DIRECTIVES:
+            continue
+        positions = [qubit_index[qubit] for qubit in qargs]
+        for cut in range(min(positions), max(positions)):
+            crossings[cut] += 1
+    return max(min(crossings[cut], cut + 1, n - cut - 1) for cut in range(n - 1))
+
+
+'''
+params
+---------------
+circuit: the circuit to run
+max_statevector_qubits: widest circuit run on the statevector method
+max_bond_dimension: MPS bond dimension cap
+truncation_threshold: MPS truncation threshold
+
+return
+---------------
+a local AerSimulator: statevector for narrow circuits, matrix product state
+otherwise. When the estimated entanglement fits under the bond dimension
+cap the MPS run is exact; beyond it the cap and truncation make it an
+approximation
+'''
+def select_backend(circuit,
+                   max_statevector_qubits=STATEVECTOR_MAX_QUBITS,
+                   max_bond_dimension=MPS_MAX_BOND_DIMENSION,
+                   truncation_threshold=MPS_TRUNCATION_THRESHOLD):
+    # Aer is only loaded once something is run
+    from qiskit.providers.aer import AerSimulator
+
+    if circuit.num_qubits <= max_statevector_qubits:
+        return AerSimulator(method='statevector')
+    if estimate_entanglement(circuit) <= math.log2(max_bond_dimension):
+        # exact within the cap: no need to truncate
+        truncation_threshold = 0.0
+    return AerSimulator(method='matrix_product_state',
+                        matrix_product_state_max_bond_dimension=max_bond_dimension,
+                        matrix_product_state_truncation_threshold=truncation_threshold)
+
+
+'''
+params
+---------------
+circuit: the circuit to run, with measurements
+cache: optional transpile_cache.TranspileCache for the compiled circuit
+lower_mcx: replace wide mcx gates with ancilla-based decompositions on idle
+qubits first (see mcx.lower); the circuit must start from the all-zero state
+optimize: then cancel and merge neighbouring gates with peephole.optimize,
+e.g. the X pairs the barrier-free builders leave between pixels
+backend_options: passed to select_backend
+
+return
+---------------
+(backend, compiled): the selected local backend and the circuit compiled
+for it, to run as many times as needed
+'''
+def prepare(circuit, cache=None, lower_mcx=True, optimize=True, **backend_options):
+    backend = select_backend(circuit, **backend_options)
+    if lower_mcx:
+        circuit, sites = mcx.lower(circuit)
+    if optimize:
+        circuit, report = peephole.optimize(circuit)
+    if cache is not None:
+        compiled = cache.transpile(circuit, backend)
+    else:
+        compiled = transpile(circuit, backend)
+    return backend, compiled
+
+
+'''
+params
+---------------
+circuit: the circuit to run, with measurements
+shots: number of shots
+options: passed to prepare
+
+return
+---------------
+the result of running the circuit on the selected local backend
+'''
+def run(circuit, shots=1024, **options):
+    backend, compiled = prepare(circuit, **options)
+    return backend.run(compiled, shots=shots).result()
@@ -0,0 +1,254 @@
+'''
+Batch construction and execution. Circuits for a list of images are built
+and transpiled in a process pool, then submitted to the local Aer backend
+as a single job, so throughput scales with the number of cores instead of
+blocking on one execute per image.
+'''
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
+import numpy as np
+
+from qiskit import QuantumCircuit, ClassicalRegister, QuantumRegister
+from qiskit import Aer
+from qiskit.compiler import transpile
+
+import mcx
+import neqr
+import steganography
+from templates import TEMPLATE_CACHE_SIZE
+
+
+'''
+params
+---------------
+image: square 2d array of grayscale values, length a power of 2
+
+return
+---------------
+the NEQR circuit of the image with intensity and position measured, built
+without the drawing barriers
+'''
+def build_neqr_circuit(image):
+    n = len(image)
+    idx = QuantumRegister(int(math.log2(n*n)), 'idx')
+    intensity = QuantumRegister(8, 'intensity')
+    cr = ClassicalRegister(idx.size + intensity.size)
+    circuit = QuantumCircuit(intensity, idx, cr)
+    neqr.neqr(neqr.convert_to_bits(image), circuit, idx, intensity, barriers=False)
+    circuit.measure(intensity[:] + idx[:], cr)
+    return circuit
+
+
+'''
+params
+---------------
+num_pixels: number of pixels of the cover and secret images
+
+return
+---------------
+(circuit, registers): the empty key circuit, laid out as in
+unit_tests.get_key_test, and its registers by role: cover_intensity,
+cover_idx, secret_intensity, secret_idx, key_idx, key_result, inv, diff1,
+diff2, comp_res and key_mes
+'''
+def key_circuit_layout(num_pixels):
+    num_idx = int(math.log2(num_pixels))
+    registers = {
+        'cover_intensity': QuantumRegister(8), 'cover_idx': QuantumRegister(num_idx),
+        'secret_intensity': QuantumRegister(8), 'secret_idx': QuantumRegister(num_idx),
+        'key_idx': QuantumRegister(num_idx), 'key_result': QuantumRegister(1),
+        'inv': QuantumRegister(8),
+        'diff1': QuantumRegister(8),
+        'diff2': QuantumRegister(8),
+        'comp_res': QuantumRegister(2),
+        'key_mes': ClassicalRegister(num_idx + 1),
+    }
+    return QuantumCircuit(*registers.values()), registers
+
+
+'''
+params
+---------------
+circuit, registers: from key_circuit_layout, with the cover and secret
+already encoded
+num_pixels: number of pixels
+use_templates: as for build_key_circuit
+
+return
+---------------
+nothing; appends the inversion, get_key without the drawing barriers, and
+the measurement of the key result and key index
+'''
+def append_key_stages(circuit, registers, num_pixels, use_templates=True):
+    r = registers
+    steganography.invert(circuit, r['secret_intensity'], r['inv'])
+    steganography.get_key(circuit, r['key_idx'], r['key_result'], r['cover_intensity'], r['secret_intensity'], r['inv'],
+                          r['diff1'], r['diff2'], r['comp_res'], num_pixels,
+                          use_templates=use_templates, barriers=False)
+    circuit.measure(r['key_result'][:] + r['key_idx'][:], r['key_mes'])
+
+
+'''
+params
+---------------
+pair: (cover, secret), two square images of the same size
+use_templates: append get_key's differences and comparator as cached
+templates, so building many circuits of one size skips re-appending their
+gates
+
+return
+---------------
+the key_circuit_layout circuit for the pair, without the drawing barriers,
+with the key result and key index measured
+'''
+def build_key_circuit(pair, use_templates=True):
+    cover, secret = pair
+    num_pixels = np.size(cover)
+    circuit, registers = key_circuit_layout(num_pixels)
+    neqr.neqr(neqr.convert_to_bits(cover), circuit, registers['cover_idx'], registers['cover_intensity'], barriers=False)
+    neqr.neqr(neqr.convert_to_bits(secret), circuit, registers['secret_idx'], registers['secret_intensity'], barriers=False)
+    append_key_stages(circuit, registers, num_pixels, use_templates)
+    return circuit
+
+
+'''
+params
+---------------
+num_pixels: number of pixels, a power of 2
+
+return
+---------------
+(circuit, theta): the neqr_parameterized circuit for images of num_pixels
+pixels, measured like build_neqr_circuit, and its angle parameters
+'''
+def build_parameterized_neqr_circuit(num_pixels):
+    idx = QuantumRegister(int(math.log2(num_pixels)), 'idx')
+    intensity = QuantumRegister(8, 'intensity')
+    flag = QuantumRegister(1, 'flag')
+    cr = ClassicalRegister(idx.size + intensity.size)
+    circuit = QuantumCircuit(intensity, idx, flag, cr)
+    theta = neqr.neqr_parameterized(circuit, idx, intensity, flag[0])
+    circuit.measure(intensity[:] + idx[:], cr)
+    return circuit, theta
+
+
+def _backend(backend_name, method):
+    backend = Aer.get_backend(backend_name)
+    if method is not None:
+        backend.set_options(method=method)
+    return backend
+
+
+def _build_and_transpile(builder, backend_name, method, optimization_level, lower_mcx, item):
+    circuit = builder(item)
+    if lower_mcx:
+        circuit, sites = mcx.lower(circuit)
+    return transpile(circuit, backend=_backend(backend_name, method), optimization_level=optimization_level)
+
+
+'''
+params
+---------------
+builder: a picklable module-level function turning one item into a circuit,
+e.g. build_neqr_circuit or build_key_circuit
+items: the images (or image pairs) to build circuits for
+backend_name: Aer backend to transpile for
+method: Aer simulation method, which decides the gates the circuits are
+transpiled to
+optimization_level: transpiler optimization level
+max_workers: process pool size, defaults to the number of cores
+lower_mcx: replace wide mcx gates with ancilla-based decompositions on idle
+qubits before transpiling (see mcx.lower)
+
+return
+---------------
+the transpiled circuits, in the order of items
+'''
+def build_batch(builder, items, backend_name='aer_simulator', method=None, optimization_level=1, max_workers=None, lower_mcx=False):
+    items = list(items)
+    work = partial(_build_and_transpile, builder, backend_name, method, optimization_level, lower_mcx)
+    workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(items) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(work, items, chunksize=chunksize))
+
+
+'''
+params
+---------------
+circuits: transpiled circuits, e.g. from build_batch
+backend_name: Aer backend to run on
+method: Aer simulation method, the same one passed to build_batch
+shots: shots per circuit
+run_options: passed to backend.run
+
+return
+---------------
+the counts of every circuit, in order, from a single batched job
+'''
+def run_batch(circuits, backend_name='aer_simulator', method=None, shots=1024, **run_options):
+    backend = _backend(backend_name, method)
+    result = backend.run(circuits, shots=shots, **run_options).result()
+    return [result.get_counts(i) for i in range(len(circuits))]
+
+
+# one transpiled parameterized circuit per image size and backend, bounded
+# like the templates
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _parameterized_template(num_pixels, backend_name, method, optimization_level):
+    circuit, theta = build_parameterized_neqr_circuit(num_pixels)
+    compiled = transpile(circuit, backend=_backend(backend_name, method), optimization_level=optimization_level)
+    return compiled, theta
+
+
+'''
+params
+---------------
+images: square images, of any mix of sizes
+backend_name, method, shots, run_options: as for run_batch
+optimization_level: transpiler optimization level
+
+return
+---------------
+the NEQR measurement counts of every image, in order, as run_batch would
+return for build_neqr_circuit; each image size is built and transpiled once
+(and only once per process), and its images are bound into one job
+'''
+def run_parameterized_batch(images, backend_name='aer_simulator', method=None, shots=1024, optimization_level=1, **run_options):
+    images = [np.asarray(image) for image in images]
+    sizes = {}
+    for i, image in enumerate(images):
+        sizes.setdefault(image.size, []).append(i)
+
+    backend = _backend(backend_name, method)
+    counts = [None] * len(images)
+    for num_pixels, indices in sizes.items():
+        compiled, theta = _parameterized_template(num_pixels, backend_name, method, optimization_level)
+        angles = np.stack([neqr.neqr_angles(neqr.convert_to_bit_array(images[i])) for i in indices])
+        binds = [{parameter: angles[:, k].tolist() for k, parameter in enumerate(theta)}]
+        result = backend.run(compiled, shots=shots, parameter_binds=binds, **run_options).result()
+        for experiment, i in enumerate(indices):
+            counts[i] = result.get_counts(experiment)
+    return counts
+
+
+'''
+params
+---------------
+pairs: list of (cover, secret) image pairs
+shots: shots per circuit
+max_workers: process pool size
+
+return
+---------------
+the key measurement counts for every pair
+'''
+def run_key_batch(pairs, shots=1024, max_workers=None):
+    # the key circuits are too wide for statevector simulation, and their
+    # wide mcx gates only transpile for MPS in reasonable time once lowered
+    method = 'matrix_product_state'
+    circuits = build_batch(build_key_circuit, pairs, method=method, max_workers=max_workers, lower_mcx=True)
+    return run_batch(circuits, method=method, shots=shots)
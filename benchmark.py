@@ -0,0 +1,303 @@
+'''
+Benchmark of the pipeline stages across image sizes and secret bit depths.
+Every (stage, size, k) case runs in a fresh worker process so its peak RSS
+is its own, and is timed separately for building the circuit, lowering and
+transpiling it for the backend backends.select_backend picks, and running
+it. Results are written as JSON for regression tracking; a stage that fails
+to build records its error instead of timings.
+
+usage: python benchmark.py --sizes 2 4 8 --ks 1 2 --output bench.json
+'''
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from multiprocessing import Pool, TimeoutError
+
+import numpy as np
+import qiskit
+from qiskit import QuantumCircuit, ClassicalRegister, QuantumRegister
+from qiskit.compiler import transpile
+
+import backends
+import batch
+import mcx
+import neqr
+import steganography
+
+STAGES = ('convert_to_bits', 'neqr', 'difference', 'comparator', 'get_key', 'embed', 'extract')
+PHASES = ('build', 'transpile', 'simulate')
+
+# modules worker processes import to build circuits, and the modules that
+# must only be loaded on first use
+STARTUP_MODULES = ('neqr', 'steganography', 'comparator', 'templates', 'ancilla', 'instrument')
+LAZY_MODULES = ('qiskit_aer', 'qiskit.providers.ibmq', 'qiskit.tools.visualization', 'matplotlib')
+
+# stages whose circuits depend on the secret bit depth
+K_STAGES = {'embed', 'extract'}
+# stages whose circuits do not depend on the image size
+SIZE_FREE_STAGES = {'difference', 'comparator'}
+
+
+def _image(size, rng):
+    return rng.integers(0, 256, size=(size, size))
+
+
+# load fixed basis values into registers with x gates
+def _load_value(circuit, register, value):
+    for i in range(len(register)):
+        if (value >> i) & 1:
+            circuit.x(register[i])
+
+
+def _difference_circuit(size, k, rng):
+    Y, X, D = QuantumRegister(8, 'Y'), QuantumRegister(8, 'X'), QuantumRegister(8, 'D')
+    cr = ClassicalRegister(8)
+    circuit = QuantumCircuit(Y, X, D, cr)
+    _load_value(circuit, Y, int(rng.integers(256)))
+    _load_value(circuit, X, int(rng.integers(256)))
+    steganography.difference(circuit, Y, X, D, barriers=False)
+    circuit.measure(D, cr)
+    return circuit
+
+
+def _comparator_circuit(size, k, rng):
+    Y, X, result = QuantumRegister(8, 'Y'), QuantumRegister(8, 'X'), QuantumRegister(2, 'result')
+    cr = ClassicalRegister(2)
+    circuit = QuantumCircuit(Y, X, result, cr)
+    _load_value(circuit, Y, int(rng.integers(256)))
+    _load_value(circuit, X, int(rng.integers(256)))
+    steganography.comparator(Y, X, circuit, result)
+    circuit.measure(result, cr)
+    return circuit
+
+
+def _embed_circuit(size, k, rng):
+    n = int(math.log2(size*size))
+    C, S, Key = QuantumRegister(n, 'C'), QuantumRegister(n, 'S'), QuantumRegister(n, 'Key')
+    cover, secret, key_i = QuantumRegister(8, 'cover'), QuantumRegister(k, 'secret'), QuantumRegister(1, 'key_i')
+    circuit = QuantumCircuit(cover, C, secret, S, Key, key_i)
+    neqr.neqr(neqr.convert_to_bits(_image(size, rng)), circuit, C, cover, barriers=False)
+    neqr.neqr(neqr.convert_to_bit_array(_image(size, rng) % 2**k, bit_depth=k), circuit, S, secret, barriers=False)
+    circuit.h(Key)
+    steganography.embed(circuit, C, S, Key, cover, secret, key_i)
+    return circuit
+
+
+def _extract_circuit(size, k, rng):
+    n = int(math.log2(size*size))
+    key_idx, key_val = QuantumRegister(n, 'key_idx'), QuantumRegister(1, 'key_val')
+    cs_idx, cs_val = QuantumRegister(n, 'cs_idx'), QuantumRegister(8, 'cs_val')
+    extracted, comp_result = QuantumRegister(k, 'extracted'), QuantumRegister(1, 'comp_result')
+    cr = ClassicalRegister(k + n)
+    circuit = QuantumCircuit(cs_val, cs_idx, key_idx, key_val, extracted, comp_result, cr)
+    neqr.neqr(neqr.convert_to_bits(_image(size, rng)), circuit, cs_idx, cs_val, barriers=False)
+    circuit.h(key_idx)
+    steganography.extract(circuit, key_idx, key_val, cs_idx, cs_val, extracted, comp_result, k)
+    circuit.measure(extracted[:] + cs_idx[:], cr)
+    return circuit
+
+
+_BUILDERS = {
+    'neqr': lambda size, k, rng: batch.build_neqr_circuit(_image(size, rng)),
+    'difference': _difference_circuit,
+    'comparator': _comparator_circuit,
+    'get_key': lambda size, k, rng: batch.build_key_circuit((_image(size, rng), _image(size, rng))),
+    'embed': _embed_circuit,
+    'extract': _extract_circuit,
+}
+
+
+def _peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _gate_counts(circuit):
+    return {name: count for name, count in circuit.count_ops().items()}
+
+
+'''
+params
+---------------
+stage: one of STAGES
+size: side length of the square images
+k: number of secret bits per pixel, or None for stages that do not use it
+phases: which of PHASES to run
+shots: shots for the simulate phase
+seed: seed for the random images
+
+return
+---------------
+the record of the case: timings in seconds per phase, gate counts, qubits,
+depth and peak RSS, or the error the case stopped on
+'''
+def run_case(stage, size, k, phases=PHASES, shots=1024, seed=0):
+    rng = np.random.default_rng(seed)
+    record = {'stage': stage, 'size': size, 'k': k}
+    try:
+        if stage == 'convert_to_bits':
+            image = _image(size, rng)
+            start = time.perf_counter()
+            neqr.convert_to_bits(image)
+            record['build_s'] = time.perf_counter() - start
+            return record
+
+        start = time.perf_counter()
+        circuit = _BUILDERS[stage](size, k or 1, rng)
+        record['build_s'] = time.perf_counter() - start
+        record['qubits'] = circuit.num_qubits
+        record['gates'] = _gate_counts(circuit)
+        record['depth'] = circuit.depth()
+
+        if 'transpile' in phases or 'simulate' in phases:
+            backend = backends.select_backend(circuit)
+            record['method'] = backend.options.method
+            start = time.perf_counter()
+            lowered, sites = mcx.lower(circuit)
+            compiled = transpile(lowered, backend)
+            record['transpile_s'] = time.perf_counter() - start
+            record['transpiled_gates'] = _gate_counts(compiled)
+
+        if 'simulate' in phases:
+            start = time.perf_counter()
+            backend.run(compiled, shots=shots).result()
+            record['simulate_s'] = time.perf_counter() - start
+    except Exception as error:
+        # the first line is enough to tell failures apart
+        record['error'] = f'{type(error).__name__}: {str(error).strip().splitlines()[0]}'
+    finally:
+        record['peak_rss_kb'] = _peak_rss_kb()
+    return record
+
+
+'''
+params
+---------------
+stages: stages to run
+sizes: image side lengths
+ks: secret bit depths, for the stages that use one
+
+return
+---------------
+every (stage, size, k) case; stages that do not depend on the image size
+appear once, with size None
+'''
+def cases(stages, sizes, ks):
+    for stage in stages:
+        for size in ([None] if stage in SIZE_FREE_STAGES else sizes):
+            for k in (ks if stage in K_STAGES else [None]):
+                yield stage, size, k
+
+
+'''
+params
+---------------
+stages, sizes, ks: passed to cases
+phases, shots, seed: passed to run_case
+timeout: seconds before a case is stopped and recorded as timed out
+
+return
+---------------
+the records of every case, each run in its own worker process
+'''
+def run(stages=STAGES, sizes=(2, 4, 8), ks=range(1, 9), phases=PHASES, shots=1024, seed=0, timeout=None):
+    results = []
+    for stage, size, k in cases(list(stages), list(sizes), list(ks)):
+        # a fresh process per case so peak RSS is per case; leaving the
+        # block terminates a worker that is still running
+        with Pool(1) as pool:
+            job = pool.apply_async(run_case, (stage, size or 2, k, tuple(phases), shots, seed))
+            try:
+                record = job.get(timeout)
+            except TimeoutError:
+                record = {'stage': stage, 'k': k, 'error': f'timed out after {timeout}s'}
+        record['size'] = size
+        results.append(record)
+        print(json.dumps(record), file=sys.stderr)
+    return results
+
+
+_STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+for module in {modules!r}:
+    __import__(module)
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [m for m in {lazy!r} if m in sys.modules]}}))
+'''
+
+
+'''
+params
+---------------
+modules: modules to import
+repeat: number of fresh interpreters to time the import in
+
+return
+---------------
+{'seconds': median import time, 'runs': every import time, 'loaded': the
+LAZY_MODULES that importing them loaded}
+'''
+def startup(modules=STARTUP_MODULES, repeat=5):
+    script = _STARTUP_SCRIPT.format(modules=tuple(modules), lazy=LAZY_MODULES)
+    runs = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    seconds = [run['seconds'] for run in runs]
+    return {'seconds': statistics.median(seconds), 'runs': seconds, 'loaded': runs[-1]['loaded']}
+
+
+def _power_of_two(value):
+    size = int(value)
+    if size < 2 or size > 64 or size & (size - 1):
+        raise argparse.ArgumentTypeError(f'{value} is not a power of 2 between 2 and 64')
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark circuit build, transpile and simulate times.')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--sizes', nargs='+', type=_power_of_two, default=[2, 4, 8],
+                        help='image side lengths, powers of 2 from 2 to 64')
+    parser.add_argument('--ks', nargs='+', type=int, choices=range(1, 9), default=list(range(1, 9)),
+                        help='secret bits per pixel, for embed and extract')
+    parser.add_argument('--phases', nargs='+', choices=PHASES, default=list(PHASES))
+    parser.add_argument('--shots', type=int, default=1024)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, help='seconds per case')
+    parser.add_argument('--startup', action='store_true',
+                        help='also time importing the builder modules in fresh interpreters')
+    parser.add_argument('--output', help='JSON output file, stdout by default')
+    args = parser.parse_args(argv)
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'qiskit': dict(qiskit.__qiskit_version__),
+            'args': vars(args),
+        },
+        'results': run(args.stages, args.sizes, args.ks, args.phases, args.shots, args.seed, args.timeout),
+    }
+    if args.startup:
+        report['startup'] = startup()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+'''
+Classical fast path for the steganography circuits. Apart from the
+Hadamards that put the position registers in superposition, every gate in
+neqr.py and steganography.py is reversible classical logic, so each branch
+of the superposition is a single bitstring. The state is kept as a
+(qubits, branches) bool array and every gate is applied to all branches at
+once with NumPy.
+
+CSX/CSXdg gates only appear in the subtractors, where each borrow qubit
+receives an even number of quarter turns before it is read. They are
+tracked as pending quarter turns (SX^2 = X, SX^4 = I) and resolved when
+the qubit is next used as a control; a qubit left on an odd quarter turn
+cannot be represented classically and raises ValueError.
+
+Branches multiply for every register that is put in superposition, so
+independent position registers (e.g. separate cover and secret indices)
+give a product of their sizes.
+'''
+import numpy as np
+from qiskit.circuit import ControlledGate
+
+_SKIP = {'barrier', 'measure', 'id', 'delay'}
+
+
+'''
+params
+---------------
+circuit: a circuit made of x, cx, ccx, mcx, swap, cswap, csx, csxdg, h on
+fresh qubits, or instructions whose definitions are
+bits: optional (qubits, branches) bool array to start from, e.g. from
+load_image; defaults to |0...0>, and qubits added to the circuit after it
+was made start in |0>
+
+return
+---------------
+a (circuit.num_qubits, branches) bool array, one column per basis state
+in the final superposition; rows follow circuit.qubits
+'''
+def simulate(circuit, bits=None):
+    bits = _fit(circuit, bits)
+    state = {'bits': bits,
+             'quarter': np.zeros(np.shape(bits), dtype=np.uint8)}
+    _run(circuit, list(range(circuit.num_qubits)), state)
+    _settle(state, range(circuit.num_qubits))
+    return state['bits']
+
+
+'''
+params
+---------------
+circuit: the circuit idx and intensity belong to
+idx: position register, idx[j] holds bit j of the pixel index
+intensity: intensity register, intensity[b] holds bit b of the value
+values: flattened grayscale values, one per pixel index
+bits: optional state to extend; every existing branch is combined with
+every pixel
+
+return
+---------------
+the state neqr would prepare, without simulating its per-pixel gates
+'''
+def load_image(circuit, idx, intensity, values, bits=None):
+    values = np.asarray(values).reshape(-1)
+    bits = _fit(circuit, bits)
+    branches = bits.shape[1]
+    bits = np.repeat(bits, len(values), axis=1)
+    pixels = np.tile(np.arange(len(values)), branches)
+    values = np.tile(values, branches)
+    for j, qubit in enumerate(idx):
+        bits[circuit.find_bit(qubit).index] = (pixels >> j) & 1
+    for b, qubit in enumerate(intensity):
+        bits[circuit.find_bit(qubit).index] = (values >> b) & 1
+    return bits
+
+
+'''
+params
+---------------
+circuit: the simulated circuit
+bits: the state returned by simulate
+register: a register (or list of qubits) of circuit
+
+return
+---------------
+an integer array with the register's value in each branch, qubit 0 being
+the least significant bit
+'''
+def register_values(circuit, bits, register):
+    values = np.zeros(bits.shape[1], dtype=np.int64)
+    for j, qubit in enumerate(register):
+        values |= bits[circuit.find_bit(qubit).index].astype(np.int64) << j
+    return values
+
+
+# qubits added to the circuit after bits was made start in |0>
+def _fit(circuit, bits):
+    if bits is None:
+        return np.zeros((circuit.num_qubits, 1), dtype=bool)
+    bits = np.asarray(bits, dtype=bool)
+    return np.pad(bits, ((0, circuit.num_qubits - len(bits)), (0, 0)))
+
+
+def _run(circuit, wires, state):
+    local = {qubit: i for i, qubit in enumerate(circuit.qubits)}
+    for instruction, qargs, cargs in circuit.data:
+        rows = [wires[local[qubit]] for qubit in qargs]
+        _apply(instruction, rows, state)
+
+
+def _apply(instruction, rows, state):
+    bits, quarter = state['bits'], state['quarter']
+    name = instruction.name
+    if name in _SKIP:
+        return
+    if name == 'h':
+        row = rows[0]
+        _settle(state, rows)
+        bits = state['bits']
+        if bits[row].any() and not bits[row].all():
+            raise ValueError('h on a qubit that differs between branches')
+        branches = bits.shape[1]
+        state['bits'] = np.concatenate([bits, bits], axis=1)
+        state['bits'][row, branches:] = ~state['bits'][row, branches:]
+        state['quarter'] = np.concatenate([quarter, quarter], axis=1)
+        return
+    if name == 'x':
+        bits[rows[0]] ^= True
+        return
+    if name in ('sx', 'sxdg'):
+        quarter[rows[0]] = (quarter[rows[0]] + (1 if name == 'sx' else 3)) % 4
+        return
+    if name == 'swap':
+        bits[rows] = bits[rows[::-1]]
+        quarter[rows] = quarter[rows[::-1]]
+        return
+    if isinstance(instruction, ControlledGate) and instruction.base_gate.name in ('x', 'sx', 'sxdg', 'swap'):
+        num_ctrl = instruction.num_ctrl_qubits
+        controls = rows[:num_ctrl]
+        targets = rows[num_ctrl:num_ctrl + instruction.base_gate.num_qubits]
+        _settle(state, controls)
+        mask = np.ones(bits.shape[1], dtype=bool)
+        for k, row in enumerate(controls):
+            mask &= bits[row] == bool((instruction.ctrl_state >> k) & 1)
+        base = instruction.base_gate.name
+        if base == 'x':
+            bits[targets[0]] ^= mask
+        elif base == 'swap':
+            a, b = targets
+            bits[a], bits[b] = np.where(mask, bits[b], bits[a]), np.where(mask, bits[a], bits[b])
+            quarter[a], quarter[b] = np.where(mask, quarter[b], quarter[a]), np.where(mask, quarter[a], quarter[b])
+        else:
+            quarter[targets[0]] = (quarter[targets[0]] + mask * (1 if base == 'sx' else 3)) % 4
+        return
+    if instruction.definition is not None:
+        _run(instruction.definition, rows, state)
+        return
+    raise ValueError(f'{name} has no classical simulation')
+
+
+# apply pending quarter turns on rows that are about to be read
+def _settle(state, rows):
+    for row in rows:
+        quarter = state['quarter'][row]
+        if not quarter.any():
+            continue
+        if (quarter % 2).any():
+            raise ValueError('qubit left in a sqrt(X) superposition')
+        state['bits'][row] ^= quarter == 2
+        quarter[:] = 0
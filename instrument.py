@@ -0,0 +1,140 @@
+'''
+Opt-in instrumentation of the circuit builders. Builders decorated with
+stage() record, while a trace() is active, their wall time, the number of
+instructions they appended, the qubits they added and optionally the depth
+they added to the circuit they were given. Stages nest, so a get_key trace
+shows its differences and comparator under it. Without an active trace a
+decorated builder costs one global lookup per call.
+
+with instrument.trace() as t:
+    steganography.get_key(...)
+print(t.summary())
+'''
+import functools
+import json
+import time
+from contextlib import contextmanager
+
+from qiskit import QuantumCircuit
+
+# the trace being recorded, if any
+_active = None
+
+
+'''
+A structured trace of instrumented builder calls.
+
+params
+---------------
+depth: also record the depth added by every stage; computing depth walks
+the whole circuit, so this is much slower than the other measurements
+'''
+class Trace:
+    def __init__(self, depth=False):
+        self.depth = depth
+        self.records = []
+        self._stack = []
+        self._origin = time.perf_counter()
+
+    def _run(self, name, func, args, kwargs):
+        circuit = next((arg for arg in list(args) + list(kwargs.values()) if isinstance(arg, QuantumCircuit)), None)
+        path = '/'.join([record['stage'] for record in self._stack] + [name])
+        record = {'stage': name, 'path': path, 'level': len(self._stack)}
+        if circuit is not None:
+            gates, qubits = len(circuit.data), circuit.num_qubits
+            depth = circuit.depth() if self.depth else None
+
+        self._stack.append(record)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record['start'] = start - self._origin
+            record['seconds'] = time.perf_counter() - start
+            self._stack.pop()
+            if circuit is not None:
+                record['gates'] = len(circuit.data) - gates
+                record['qubits'] = circuit.num_qubits - qubits
+                if self.depth:
+                    record['depth'] = circuit.depth() - depth
+            self.records.append(record)
+
+    '''
+    return
+    ---------------
+    the recorded stages in call order
+    '''
+    def events(self):
+        return sorted(self.records, key=lambda record: record['start'])
+
+    '''
+    return
+    ---------------
+    {path: totals} over every call of each stage path: calls, seconds,
+    gates, qubits (and depth if recorded)
+    '''
+    def summary(self):
+        totals = {}
+        for record in self.events():
+            total = totals.setdefault(record['path'], {'calls': 0, 'seconds': 0.0})
+            total['calls'] += 1
+            for key in ('seconds', 'gates', 'qubits', 'depth'):
+                if key in record:
+                    total[key] = total.get(key, 0) + record[key]
+        return totals
+
+    '''
+    params
+    ---------------
+    path: file to write to; the JSON text is returned when omitted
+    '''
+    def to_json(self, path=None):
+        text = json.dumps({'events': self.events(), 'summary': self.summary()}, indent=2)
+        if path is None:
+            return text
+        with open(path, 'w') as f:
+            f.write(text)
+
+
+'''
+params
+---------------
+depth: also record depth deltas (slow)
+
+return
+---------------
+a context manager recording every instrumented stage run inside it into
+the Trace it yields
+'''
+@contextmanager
+def trace(depth=False):
+    global _active
+    previous = _active
+    _active = Trace(depth)
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+
+'''
+params
+---------------
+name: name of the stage, the function name by default
+
+return
+---------------
+a decorator instrumenting a builder; the circuit measured is the first
+QuantumCircuit argument of the call
+'''
+def stage(name=None):
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            return _active._run(label, func, args, kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,158 @@
+'''
+Ancilla-aware lowering of multi-controlled X gates. The builders call mcx
+with up to 2*log2(N)+2 controls and no ancillas, which the transpiler
+expands with the ancilla-free decomposition whose size grows quadratically
+with the number of controls. Most of these circuits have plenty of qubits
+that are idle at each call site, so every wide mcx is replaced with the
+cheapest decomposition the idle qubits allow:
+
+v-chain: num_ctrl - 2 clean ancillas (qubits not yet touched, so still in
+|0>), built from relative-phase Toffolis
+v-chain-dirty: num_ctrl - 2 ancillas in any state, restored afterwards
+recursion: a single ancilla in any state
+noancilla: no free qubit at all
+'''
+from qiskit.circuit import ControlledGate, Gate, Instruction
+from qiskit.circuit.library import MCXGate, MCXGrayCode, MCXRecursive, MCXVChain
+from qiskit.compiler import transpile
+
+# gates that already come with ancillas are left as they are
+_WITH_ANCILLAS = (MCXVChain, MCXRecursive)
+
+_NOT_TOUCHING = {'barrier', 'delay', 'id'}
+
+
+'''
+params
+---------------
+num_ctrl: number of controls
+clean: number of available ancillas in |0>
+dirty: number of available ancillas in an unknown state
+
+return
+---------------
+(mode, number of ancillas it uses, whether they must be clean)
+'''
+def choose_mode(num_ctrl, clean, dirty):
+    needed = MCXGate.get_num_ancilla_qubits(num_ctrl, 'v-chain')
+    if clean >= needed:
+        return 'v-chain', needed, True
+    if clean + dirty >= needed:
+        return 'v-chain-dirty', needed, False
+    needed = MCXGate.get_num_ancilla_qubits(num_ctrl, 'recursion')
+    if clean + dirty >= needed:
+        return 'recursion', needed, False
+    return 'noancilla', 0, False
+
+
+def _lowerable(instruction):
+    # QuantumCircuit.mcx appends C3XGate/C4XGate for three or four controls,
+    # MCXGrayCode beyond
+    return (isinstance(instruction, ControlledGate) and instruction.base_gate.name == 'x'
+            and not isinstance(instruction, _WITH_ANCILLAS))
+
+
+def _flatten(circuit, phase):
+    # instructions from templates (plain Instruction or Gate built with
+    # to_instruction) hide their mcx gates, so they are inlined; their global
+    # phases are added to phase[0]
+    for position, (instruction, qargs, cargs) in enumerate(circuit.data):
+        if type(instruction) in (Instruction, Gate) and instruction.definition is not None:
+            definition = instruction.definition
+            phase[0] += definition.global_phase
+            qubits = dict(zip(definition.qubits, qargs))
+            clbits = dict(zip(definition.clbits, cargs))
+            for _, inner, inner_qargs, inner_cargs in _flatten(definition, phase):
+                yield position, inner, [qubits[q] for q in inner_qargs], [clbits[c] for c in inner_cargs]
+        else:
+            yield position, instruction, qargs, cargs
+
+
+def _gate(mode, num_ctrl, ctrl_state):
+    if mode == 'v-chain':
+        return MCXVChain(num_ctrl, dirty_ancillas=False, ctrl_state=ctrl_state)
+    if mode == 'v-chain-dirty':
+        return MCXVChain(num_ctrl, dirty_ancillas=True, ctrl_state=ctrl_state)
+    if mode == 'recursion':
+        return MCXRecursive(num_ctrl, ctrl_state=ctrl_state)
+    return MCXGrayCode(num_ctrl, ctrl_state=ctrl_state)
+
+
+'''
+params
+---------------
+circuit: a circuit starting from the all-zero state
+min_controls: mcx gates with fewer controls are left alone (up to two
+controls they are already cx and ccx)
+
+return
+---------------
+(lowered, sites): a copy of the circuit with every wide mcx replaced by its
+chosen decomposition on idle qubits, and one report per replaced gate:
+{'position', 'controls', 'mode', 'ancillas'}; instructions appended from
+templates are inlined, and report the position of the template
+'''
+def lower(circuit, min_controls=3):
+    lowered = circuit.copy_empty_like()
+    touched = set()
+    sites = []
+    phase = [0]
+    for position, instruction, qargs, cargs in _flatten(circuit, phase):
+        if _lowerable(instruction) and instruction.num_ctrl_qubits >= min_controls:
+            used = set(qargs)
+            clean = [qubit for qubit in circuit.qubits if qubit not in used and qubit not in touched]
+            dirty = [qubit for qubit in circuit.qubits if qubit not in used and qubit in touched]
+            mode, needed, must_be_clean = choose_mode(instruction.num_ctrl_qubits, len(clean), len(dirty))
+            # clean qubits first, so dirty modes still disturb as few used qubits as possible
+            ancillas = (clean if must_be_clean else clean + dirty)[:needed]
+            gate = _gate(mode, instruction.num_ctrl_qubits, instruction.ctrl_state)
+            lowered.append(gate, list(qargs) + ancillas, cargs)
+            sites.append({'position': position,
+                          'controls': instruction.num_ctrl_qubits,
+                          'mode': mode,
+                          'ancillas': len(ancillas)})
+            # a clean v-chain returns its ancillas to |0>, so only dirty modes touch them
+            touched.update(qargs)
+            if not must_be_clean:
+                touched.update(ancillas)
+            continue
+        lowered.append(instruction, qargs, cargs)
+        if instruction.name not in _NOT_TOUCHING:
+            touched.update(qargs)
+    lowered.global_phase += phase[0]
+    return lowered, sites
+
+
+'''
+params
+---------------
+circuit: a circuit
+basis_gates: basis to transpile to
+optimization_level: transpiler optimization level
+
+return
+---------------
+{'cx': number of cx gates, 'depth': depth} of the transpiled circuit
+'''
+def cost(circuit, basis_gates=('u', 'cx', 'id'), optimization_level=1):
+    compiled = transpile(circuit, basis_gates=list(basis_gates), optimization_level=optimization_level)
+    return {'cx': compiled.count_ops().get('cx', 0), 'depth': compiled.depth()}
+
+
+'''
+params
+---------------
+circuit: a circuit starting from the all-zero state
+basis_gates: basis to transpile to
+optimization_level: transpiler optimization level
+
+return
+---------------
+(lowered, report): the lowered circuit, and the transpiled cost before and
+after lowering together with the per-site choices
+'''
+def lower_with_report(circuit, basis_gates=('u', 'cx', 'id'), optimization_level=1):
+    lowered, sites = lower(circuit)
+    return lowered, {'before': cost(circuit, basis_gates, optimization_level),
+                     'after': cost(lowered, basis_gates, optimization_level),
+                     'sites': sites}
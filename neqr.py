@@ -1,15 +1,52 @@
-import qiskit
-
-from qiskit import QuantumCircuit, ClassicalRegister, QuantumRegister
-from qiskit import execute
-from qiskit import Aer
-from qiskit import IBMQ
-from qiskit.compiler import transpile
-from time import perf_counter
-from qiskit.tools.visualization import plot_histogram
+import logging
 
 import numpy as np
-import math
+from qiskit import QuantumCircuit
+from qiskit.circuit import ParameterVector
+
+import instrument
+
+logger = logging.getLogger(__name__)
+
+'''
+params
+---------------
+picture: 2d array of integers representing grayscale values, any shape
+bit_depth: number of bits used for each grayscale value
+
+return
+---------------
+a (rows*cols, bit_depth) uint8 array holding the bits of each pixel,
+most significant bit first, in row-major pixel order
+'''
+def convert_to_bit_array (picture, bit_depth=8):
+    values = np.asarray(picture)
+    assert values.ndim == 2
+    assert values.size == 0 or (values.min() >= 0 and values.max() < 2**bit_depth)
+    values = values.reshape(-1)
+    if bit_depth == 8:
+        return np.unpackbits(values.astype(np.uint8)[:, None], axis=1)
+    shifts = np.arange(bit_depth - 1, -1, -1, dtype=np.uint64)
+    return ((values.astype(np.uint64)[:, None] >> shifts) & 1).astype(np.uint8)
+
+
+'''
+params
+---------------
+picture: 2d array of integers representing grayscale values, any shape;
+can also be a numpy memmap for images that do not fit in memory
+block_rows: number of picture rows converted per block
+bit_depth: number of bits used for each grayscale value
+
+return
+---------------
+a generator of (block_rows*cols, bit_depth) uint8 arrays, which concatenate
+to convert_to_bit_array(picture, bit_depth)
+'''
+def iter_bit_blocks (picture, block_rows=64, bit_depth=8):
+    for start in range(0, len(picture), block_rows):
+        yield convert_to_bit_array(picture[start:start + block_rows], bit_depth)
+
 
 '''
 params
@@ -22,36 +59,24 @@ return
 a flattened representation of picture using bitstrings (boolean arrays)
 '''
 def convert_to_bits (picture):
-    n = len(picture)
-    ret = []
-    for i in range(n):
-        for j in range(n):
-            value = picture[i][j]
-            bitstring = bin(value)[2:]
-            ret.append([0 for i in range(8 - len(bitstring))] + [1 if c=='1' else 0 for c in bitstring])
-    return ret
+    return convert_to_bit_array(picture).tolist()
 
 
 '''
 params
 ----------------
 bitStr: a representation of an image using bitstrings to represent grayscale values
+barriers: separate the pixels with barriers, for drawing; without them the
+X gates undoing one pixel's zero controls can cancel the next pixel's
 
 return
 ----------------
 A quantum circuit containing the NEQR representation of the image
 '''
-def neqr(bitStr, quantumImage, idx, intensity): 
+@instrument.stage()
+def neqr(bitStr, quantumImage, idx, intensity, barriers=True): 
     newBitStr = bitStr
 
-    numOfQubits = quantumImage.num_qubits
-
-    quantumImage.draw()
-    print("Number of Qubits:", numOfQubits)
-
-    # -----------------------------------
-    # Drawing the Quantum Circuit
-    # -----------------------------------
     lengthIntensity = intensity.size
     lengthIdx = idx.size
 
@@ -80,6 +105,287 @@ def neqr(bitStr, quantumImage, idx, intensity):
             if bin_ind[j] == '0':
                 quantumImage.x(idx[j])
 
-        quantumImage.barrier()
+        if barriers:
+            quantumImage.barrier()
+
+    _debug_circuit(quantumImage)
+
+
+# drawing walks the whole circuit, so it only happens with debug logging on
+def _debug_circuit(circuit):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Number of Qubits: %d", circuit.num_qubits)
+        logger.debug("\n%s", circuit.draw(output='text'))
+
+
+'''
+params
+----------------
+bitStr: a representation of an image using bitstrings to represent grayscale values
+idx: position register
+intensity: intensity register
+encoder: neqr, neqr_gray or neqr_compressed
+options: passed to the encoder, e.g. barriers=False for neqr
+
+return
+----------------
+a new circuit on just intensity and idx holding the NEQR gates, to be
+added to a larger circuit with compose(sub_circuit, qubits=sub_circuit.qubits)
+'''
+def build_neqr(bitStr, idx, intensity, encoder=neqr, **options):
+    sub_circuit = QuantumCircuit(intensity, idx)
+    encoder(bitStr, sub_circuit, idx, intensity, **options)
+    return sub_circuit
+
+
+'''
+params
+----------------
+size: number of pixel indices
+
+return
+----------------
+the indices 0..size-1 in reflected Gray-code order, so consecutive
+indices differ in exactly one bit
+'''
+def gray_code_order(size):
+    n = max(size - 1, 0).bit_length()
+    return [g for g in (i ^ (i >> 1) for i in range(2**n)) if g < size]
+
+
+'''
+params
+----------------
+circuit: the circuit containing idx
+idx: the position register the zero-controlled gates are conditioned on
+indices: the pixel indices to visit, in order
+apply: called with each index while idx is flipped so that the index
+reads as all ones, i.e. plain mcx gates on idx act as zero-controlled ones
+
+return
+----------------
+nothing; only the idx bits that change between consecutive indices are
+toggled, and idx is restored at the end
+'''
+def walk_indices(circuit, idx, indices, apply):
+    lengthIdx = len(idx)
+    full = 2**lengthIdx - 1
+    flipped = 0
+    for i in indices:
+        toggle = flipped ^ (~i & full)
+        for j in range(lengthIdx):
+            if (toggle >> j) & 1:
+                circuit.x(idx[j])
+        flipped ^= toggle
+        apply(i)
+    for j in range(lengthIdx):
+        if (flipped >> j) & 1:
+            circuit.x(idx[j])
+
+
+'''
+params
+----------------
+bitStr: a representation of an image using bitstrings to represent grayscale values
+
+return
+----------------
+Same state as neqr, but pixels are visited in Gray-code order so only one
+index X gate is needed between neighbouring pixels, and pixels with zero
+intensity are skipped entirely
+'''
+@instrument.stage()
+def neqr_gray(bitStr, quantumImage, idx, intensity):
+    quantumImage.h(idx)
+    # neqr_delta logs the circuit
+    neqr_delta(bitStr, quantumImage, idx, intensity)
+
 
+'''
+params
+----------------
+deltaBits: per pixel bitstrings to XOR into the intensity, e.g. the XOR of
+two frames' convert_to_bits
+quantumImage: circuit holding an NEQR image on idx and intensity
 
+return
+----------------
+nothing; every pixel's intensity is XORed with its delta bits, so the NEQR
+state of one image becomes the NEQR state of the other. Pixels are visited
+in Gray-code order and unchanged pixels cost no gates
+'''
+@instrument.stage()
+def neqr_delta(deltaBits, quantumImage, idx, intensity):
+    lengthIntensity = intensity.size
+
+    def load_pixel(i):
+        for j in range(len(deltaBits[i])):
+            if deltaBits[i][j] == 1:
+                quantumImage.mcx(idx, intensity[lengthIntensity-1-j])
+
+    indices = [i for i in gray_code_order(len(deltaBits)) if any(b == 1 for b in deltaBits[i])]
+    walk_indices(quantumImage, idx, indices, load_pixel)
+    _debug_circuit(quantumImage)
+
+
+'''
+params
+----------------
+frames: iterable of same-shaped 8-bit grayscale frames, consumed lazily
+idx: position register
+intensity: intensity register
+keyframe_interval: emit a full encoding every this many frames, so a
+consumer can start there; only the first frame is a keyframe by default
+
+return
+----------------
+a generator of (circuit, info), one per frame, each circuit on just
+intensity and idx: keyframes hold the full NEQR of the frame, the others
+only the XOR-delta gates turning the previous frame's NEQR state into this
+frame's. info is {'frame', 'keyframe', 'changed_pixels', 'gates'}, where
+changed_pixels counts the pixels the circuit touches. Only the previous
+frame's bits are kept between frames
+'''
+def neqr_frames(frames, idx, intensity, keyframe_interval=None):
+    previous = None
+    for number, frame in enumerate(frames):
+        bits = convert_to_bit_array(frame)
+        keyframe = previous is None or (keyframe_interval is not None and number % keyframe_interval == 0)
+        if keyframe:
+            circuit = build_neqr(bits, idx, intensity, encoder=neqr_gray)
+            changed = int(bits.any(axis=1).sum())
+        else:
+            assert bits.shape == previous.shape
+            delta = bits ^ previous
+            circuit = build_neqr(delta, idx, intensity, encoder=neqr_delta)
+            changed = int(delta.any(axis=1).sum())
+        previous = bits
+        yield circuit, {'frame': number, 'keyframe': keyframe, 'changed_pixels': changed, 'gates': len(circuit.data)}
+
+
+'''
+params
+----------------
+minterms: set of pixel indices where a bit plane is 1
+num_bits: number of bits in a pixel index
+
+return
+----------------
+a list of disjoint cubes (care, value) covering exactly the minterms; an
+index i is in a cube when i & care == value. Halves of the index space
+that hold the same pattern are merged, so uniform regions collapse into
+a few cubes with short controls
+'''
+def cube_cover(minterms, num_bits):
+    full = 2**num_bits - 1
+
+    def cover(terms, variables, merged):
+        if not terms:
+            return []
+        if len(terms) == 2**len(variables):
+            free = merged
+            for v in variables:
+                free |= 1 << v
+            care = full & ~free
+            return [(care, next(iter(terms)) & care)]
+        v, rest = variables[0], variables[1:]
+        low = frozenset(t for t in terms if not (t >> v) & 1)
+        high = frozenset(t for t in terms if (t >> v) & 1)
+        if low == frozenset(t ^ (1 << v) for t in high):
+            return cover(low, rest, merged | (1 << v))
+        return cover(low, rest, merged) + cover(high, rest, merged)
+
+    return cover(frozenset(minterms), list(range(num_bits - 1, -1, -1)), 0)
+
+
+'''
+params
+----------------
+bitStr: a representation of an image using bitstrings to represent grayscale values
+
+return
+----------------
+Same state as neqr, built from the cube cover of each intensity bit plane
+instead of one mcx per set bit per pixel, and a report per plane:
+{plane: {'pixels': set bits, 'gates': mcx gates emitted, 'saved': gates saved,
+'controls': total controls used}}
+'''
+@instrument.stage()
+def neqr_compressed(bitStr, quantumImage, idx, intensity):
+    lengthIntensity = intensity.size
+    lengthIdx = idx.size
+    quantumImage.h(idx)
+
+    bits = np.asarray(bitStr)
+    report = {}
+    for j in range(bits.shape[1]):
+        target = intensity[lengthIntensity-1-j]
+        cubes = cube_cover(np.flatnonzero(bits[:, j]).tolist(), lengthIdx)
+        controls = 0
+        for care, value in cubes:
+            zeros = [idx[b] for b in range(lengthIdx) if (care >> b) & 1 and not (value >> b) & 1]
+            ctrl = [idx[b] for b in range(lengthIdx) if (care >> b) & 1]
+            controls += len(ctrl)
+            if zeros:
+                quantumImage.x(zeros)
+            if ctrl:
+                quantumImage.mcx(ctrl, target)
+            else:
+                quantumImage.x(target)
+            if zeros:
+                quantumImage.x(zeros)
+        pixels = int(bits[:, j].sum())
+        report[j] = {'pixels': pixels, 'gates': len(cubes), 'saved': pixels - len(cubes), 'controls': controls}
+    _debug_circuit(quantumImage)
+    return report
+
+
+'''
+params
+----------------
+quantumImage: circuit holding idx, intensity and flag
+flag: a qubit in |0>, returned to |0>
+theta: ParameterVector of 2**len(idx) * len(intensity) angles, created
+when omitted
+
+return
+----------------
+theta; the circuit loads no particular image: bit j (most significant
+first) of pixel i is rotated by RY(theta[i*len(intensity) + j]), controlled
+on the pixel's index through flag, so binding neqr_angles(bitStr) gives the
+same state as neqr. One circuit serves every image of the same size, and is
+transpiled once and rebound per image
+'''
+@instrument.stage()
+def neqr_parameterized(quantumImage, idx, intensity, flag, theta=None):
+    lengthIntensity = intensity.size
+    numOfPixels = 2**idx.size
+    if theta is None:
+        theta = ParameterVector('theta', numOfPixels * lengthIntensity)
+    quantumImage.h(idx)
+
+    # multi-controlled rotations cannot take unbound parameters, so the
+    # index match is computed into flag and every slot is a cry on it
+    def load_pixel(i):
+        quantumImage.mcx(idx, flag)
+        for j in range(lengthIntensity):
+            quantumImage.cry(theta[i*lengthIntensity + j], flag, intensity[lengthIntensity-1-j])
+        quantumImage.mcx(idx, flag)
+
+    walk_indices(quantumImage, idx, gray_code_order(numOfPixels), load_pixel)
+    _debug_circuit(quantumImage)
+    return theta
+
+
+'''
+params
+----------------
+bitStr: a representation of an image using bitstrings to represent grayscale values
+
+return
+----------------
+the angles to bind to neqr_parameterized's theta: pi for every set bit, 0
+otherwise, in the same pixel-major order
+'''
+def neqr_angles(bitStr):
+    return np.asarray(bitStr, dtype=float).reshape(-1) * np.pi
@@ -0,0 +1,114 @@
+'''
+Targeted peephole pass for the builders' compact (barrier-free) circuits.
+Two neighbouring gates on exactly the same qubits, with nothing else on
+those qubits between them, are combined:
+
+a self-inverse gate followed by the same gate cancels (the X pairs around
+zero-controlled mcx gates, CX pairs of the subtractors)
+csx followed by csxdg (or the reverse) on the same control and target cancels
+csx followed by csx, or csxdg by csxdg, is a cx
+
+Combined gates are combined again with whatever they then neighbour, so
+nested pairs collapse completely. Barriers, measurements and conditioned
+gates are never combined and block combinations across them.
+'''
+from qiskit.circuit import ControlledGate
+from qiskit.circuit.library import CXGate
+
+# gates that are their own inverse, when applied to the same qubits in the same order
+SELF_INVERSE = {'x', 'y', 'z', 'h', 'cx', 'cy', 'cz', 'ccx', 'swap', 'cswap'}
+
+_ROOTS = {'sx', 'sxdg'}
+
+
+def _controlled_base(instruction):
+    if isinstance(instruction, ControlledGate) and instruction.num_ctrl_qubits == 1:
+        return instruction.base_gate.name, instruction.ctrl_state
+    return None, None
+
+
+def _self_inverse(instruction):
+    if instruction.name in SELF_INVERSE:
+        return True
+    # mcx gates of any width and control state
+    return isinstance(instruction, ControlledGate) and instruction.base_gate.name == 'x'
+
+
+'''
+params
+---------------
+first: the earlier instruction
+second: the later instruction, on the same qubits in the same order
+
+return
+---------------
+None when they do not combine, else the list of instructions replacing the
+pair: empty when they cancel
+'''
+def combine(first, second):
+    if getattr(first, 'condition', None) is not None or getattr(second, 'condition', None) is not None:
+        return None
+    if _self_inverse(first) and first == second:
+        return []
+    base1, state1 = _controlled_base(first)
+    base2, state2 = _controlled_base(second)
+    if base1 in _ROOTS and base2 in _ROOTS and state1 == state2 == 1:
+        return [] if base1 != base2 else [CXGate()]
+    return None
+
+
+'''
+params
+---------------
+circuit: a circuit, ideally built without barriers
+
+return
+---------------
+(optimized, report): a new equivalent circuit, and a report with the
+number of gates and the depth before and after, and how many pairs were
+cancelled and merged
+'''
+def optimize(circuit):
+    ops = []           # [instruction, qargs, cargs], None once removed
+    last = {}          # qubit or clbit -> indices of its live ops, in order
+    report = {'cancelled': 0, 'merged': 0}
+
+    def top(wire):
+        stack = last.get(wire)
+        return stack[-1] if stack else None
+
+    def push(instruction, qargs, cargs):
+        wires = list(qargs) + list(cargs)
+        while True:
+            candidates = {top(wire) for wire in wires}
+            index = candidates.pop() if len(candidates) == 1 else None
+            if index is None or cargs or ops[index][1] != qargs or ops[index][2]:
+                break
+            replacement = combine(ops[index][0], instruction)
+            if replacement is None:
+                break
+            ops[index] = None
+            for wire in wires:
+                last[wire].pop()
+            if not replacement:
+                report['cancelled'] += 1
+                return
+            # a merged gate may combine again with what is now before it
+            report['merged'] += 1
+            instruction, = replacement
+        ops.append([instruction, qargs, cargs])
+        for wire in wires:
+            last.setdefault(wire, []).append(len(ops) - 1)
+
+    for instruction, qargs, cargs in circuit.data:
+        push(instruction, list(qargs), list(cargs))
+
+    optimized = circuit.copy_empty_like()
+    for op in ops:
+        if op is not None:
+            optimized.append(*op)
+    report.update({'gates_before': len(circuit.data),
+                   'gates_after': len(optimized.data),
+                   'depth_before': circuit.depth(),
+                   'depth_after': optimized.depth()})
+    return optimized, report
@@ -0,0 +1,222 @@
+'''
+Decoding of simulation results without scanning every amplitude in Python.
+Nonzero amplitudes are found with NumPy, and register fields are read out
+of the basis state indices with bit masks (RegisterLayout), so an NEQR
+image comes back as an array directly from a statevector or from sampled
+counts.
+'''
+import math
+
+import numpy as np
+
+
+'''
+params
+---------------
+statevec: a statevector (array or qiskit Statevector)
+atol: amplitudes with magnitude at or below this are treated as zero
+
+return
+---------------
+(indices, amplitudes) of the basis states with nonzero amplitude
+'''
+def nonzero_states(statevec, atol=1e-12):
+    amplitudes = np.asarray(statevec)
+    indices = np.flatnonzero(np.abs(amplitudes) > atol)
+    return indices, amplitudes[indices]
+
+
+'''
+params
+---------------
+indices: integer array of basis state (or measured outcome) indices
+positions: bit position in the index of each bit of a field, least
+significant first
+
+return
+---------------
+the field's value for every index
+'''
+def field_values(indices, positions):
+    return _read_field(np.asarray(indices), _field_table(positions))
+
+
+# (shift, mask) when the positions are contiguous, else the positions themselves
+def _field_table(positions):
+    positions = list(positions)
+    start = positions[0] if positions else 0
+    if positions == list(range(start, start + len(positions))):
+        return (start, (1 << len(positions)) - 1)
+    return positions
+
+
+def _read_field(indices, table):
+    if isinstance(table, tuple):
+        shift, mask = table
+        return (indices >> shift) & mask
+    values = np.zeros(indices.shape, dtype=indices.dtype)
+    for j, position in enumerate(table):
+        values |= ((indices >> position) & 1) << j
+    return values
+
+
+'''
+Bit layout of a circuit's registers. The shift/mask (or gather) table of
+every register is built once from the circuit, then whole statevectors or
+counts dictionaries are decoded into one integer array per register in a
+single vectorized pass, with no per-result string manipulation.
+
+params
+---------------
+circuit: the circuit the results come from
+'''
+class RegisterLayout:
+    def __init__(self, circuit):
+        self.num_qubits = circuit.num_qubits
+        self.num_clbits = circuit.num_clbits
+        self.qubit_fields = {reg.name: _field_table([circuit.find_bit(qubit).index for qubit in reg])
+                             for reg in circuit.qregs}
+        self.clbit_fields = {reg.name: _field_table([circuit.find_bit(clbit).index for clbit in reg])
+                             for reg in circuit.cregs}
+
+        # quantum registers whose qubits were all measured, by clbit position
+        clbit_of = {}
+        for instruction, qargs, cargs in circuit.data:
+            if instruction.name == 'measure':
+                clbit_of[qargs[0]] = circuit.find_bit(cargs[0]).index
+        self.measured_fields = {reg.name: _field_table([clbit_of[qubit] for qubit in reg])
+                                for reg in circuit.qregs
+                                if all(qubit in clbit_of for qubit in reg)}
+
+    '''
+    params
+    ---------------
+    statevec: statevector of the circuit
+    names: quantum register names to decode, all by default
+
+    return
+    ---------------
+    {register name: values} for every basis state with nonzero amplitude,
+    plus 'amplitude'
+    '''
+    def decode_statevector(self, statevec, names=None):
+        indices, amplitudes = nonzero_states(statevec)
+        fields = self._select(self.qubit_fields, names)
+        decoded = {name: _read_field(indices, table) for name, table in fields.items()}
+        decoded['amplitude'] = amplitudes
+        return decoded
+
+    '''
+    params
+    ---------------
+    counts: counts dictionary of the circuit
+    names: register names to decode; classical registers and fully measured
+    quantum registers are both available, all by default
+
+    return
+    ---------------
+    {register name: values} for every distinct outcome, plus 'counts'
+    '''
+    def decode_counts(self, counts, names=None):
+        # wider than an int64 falls back to Python integers
+        dtype = np.int64 if self.num_clbits < 63 else object
+        outcomes = np.array([int(key.replace(' ', ''), 2) for key in counts], dtype=dtype)
+        fields = self._select({**self.measured_fields, **self.clbit_fields}, names)
+        decoded = {name: _read_field(outcomes, table) for name, table in fields.items()}
+        decoded['counts'] = np.array(list(counts.values()))
+        return decoded
+
+    def _select(self, fields, names):
+        if names is None:
+            return fields
+        return {name: fields[name] for name in names}
+
+
+def _square(size):
+    side = math.isqrt(size)
+    return (side, size // side)
+
+
+'''
+params
+---------------
+statevec: statevector of an NEQR circuit
+circuit: the circuit, for the qubit positions of idx and intensity
+idx: position register
+intensity: intensity register
+shape: shape of the image, square by default
+layout: a RegisterLayout of circuit, to reuse across results
+
+return
+---------------
+the decoded image array
+'''
+def decode_neqr(statevec, circuit, idx, intensity, shape=None, layout=None):
+    layout = layout or RegisterLayout(circuit)
+    decoded = layout.decode_statevector(statevec, [idx.name, intensity.name])
+    image = np.zeros(2**len(idx), dtype=np.int64)
+    image[decoded[idx.name]] = decoded[intensity.name]
+    return image.reshape(shape or _square(len(image)))
+
+
+'''
+params
+---------------
+counts: measurement counts of an NEQR circuit with idx and intensity measured
+circuit: the circuit, for which clbits idx and intensity were measured into
+idx: position register
+intensity: intensity register
+shape: shape of the image, square by default
+layout: a RegisterLayout of circuit, to reuse across results
+
+return
+---------------
+(image, seen): the most frequently measured intensity of every pixel, and a
+bool mask of the pixels that were sampled at least once
+'''
+def decode_neqr_counts(counts, circuit, idx, intensity, shape=None, layout=None):
+    layout = layout or RegisterLayout(circuit)
+    decoded = layout.decode_counts(counts, [idx.name, intensity.name])
+    pixels, values = decoded[idx.name], decoded[intensity.name]
+
+    # keep the most frequent value per pixel: sort by pixel, then count, and
+    # take the last entry of every pixel's run (the first once reversed)
+    order = np.lexsort((decoded['counts'], pixels))[::-1]
+    kept, first = np.unique(pixels[order], return_index=True)
+    image = np.zeros(2**len(idx), dtype=np.int64)
+    image[kept] = values[order[first]]
+    seen = np.zeros(2**len(idx), dtype=bool)
+    seen[pixels] = True
+    shape = shape or _square(len(image))
+    return image.reshape(shape), seen.reshape(shape)
+
+
+'''
+params
+---------------
+num_pixels: number of pixels in the uniform superposition
+confidence: probability that every pixel is sampled at least once
+
+return
+---------------
+shots needed so that, by the union bound, all pixels are seen with the
+given confidence
+'''
+def neqr_shots(num_pixels, confidence=0.99):
+    if num_pixels <= 1:
+        return 1
+    return math.ceil(math.log(num_pixels / (1 - confidence)) / -math.log1p(-1 / num_pixels))
+
+
+'''
+params
+---------------
+num_pixels: number of pixels in the uniform superposition
+shots: number of shots
+
+return
+---------------
+expected fraction of pixels sampled at least once
+'''
+def expected_coverage(num_pixels, shots):
+    return 1 - (1 - 1 / num_pixels)**shots
@@ -0,0 +1,108 @@
+'''
+Classical reference implementation of the steganography protocol. It has
+the same semantics as the circuit builders in steganography.py, computed
+on whole NumPy image arrays instead of quantum registers, so it serves both
+as an oracle for validating the circuits (reference_circuit_test checks
+get_key, embed and extract against them) and as the fast path for batch
+jobs. Values are plain integers; the circuits hold them with qubit 0 the
+least significant bit, as neqr writes them. Every function broadcasts over
+leading batch dimensions.
+'''
+import numpy as np
+
+
+'''
+params
+---------------
+binary_images: array of shape (..., k, rows, cols) holding k binary images;
+the first image becomes the most significant bit, as in get_secret_image
+
+return
+---------------
+the (..., rows, cols) secret image with k-bit grayscale values, uint8 for
+k up to 8 and uint16 for k up to 16
+'''
+def secret_image(binary_images):
+    planes = np.asarray(binary_images)
+    k = planes.shape[-3]
+    assert k <= 16
+    dtype = np.uint8 if k <= 8 else np.uint16
+    shifts = np.arange(k - 1, -1, -1, dtype=dtype).reshape(k, 1, 1)
+    return np.bitwise_or.reduce(planes.astype(dtype) << shifts, axis=-3)
+
+
+'''
+params
+---------------
+secret: k-bit secret image values
+k: number of bits per secret pixel
+
+return
+---------------
+the inverse secret image, every bit of every pixel flipped; uint8 for k up
+to 8 and uint16 for k up to 16, as secret_image returns
+'''
+def invert(secret, k):
+    assert k <= 16
+    return ((2**k - 1) ^ np.asarray(secret)).astype(np.uint8 if k <= 8 else np.uint16)
+
+
+'''
+params
+---------------
+cover: 8-bit cover image values
+secret: k-bit secret image values, same shape as cover
+k: number of bits per secret pixel
+
+return
+---------------
+the key image: 1 where the k low bits of the cover are strictly closer to
+the secret than to the inverse secret (comparator result 01 in get_key),
+0 otherwise
+'''
+def get_key(cover, secret, k):
+    # the secret replaces low bits of an 8-bit cover
+    assert k <= 8
+    low = (np.asarray(cover) & (2**k - 1)).astype(np.int16)
+    secret = np.asarray(secret).astype(np.int16)
+    diff1 = np.abs(low - secret)
+    diff2 = np.abs(low - invert(secret, k))
+    return (diff1 < diff2).astype(np.uint8)
+
+
+'''
+params
+---------------
+cover: 8-bit cover image values
+secret: k-bit secret image values, same shape as cover
+k: number of bits per secret pixel
+
+return
+---------------
+(stego, key): the cover with its k low bit planes replaced by the secret
+where the key is 1 and by the inverse secret where it is 0, and the key
+'''
+def embed(cover, secret, k):
+    assert k <= 8
+    cover = np.asarray(cover).astype(np.uint8)
+    key = get_key(cover, secret, k)
+    hidden = np.where(key == 1, secret, invert(secret, k)).astype(np.uint8)
+    stego = (cover & ~np.uint8(2**k - 1)) | hidden
+    return stego, key
+
+
+'''
+params
+---------------
+stego: 8-bit stego image values
+key: the key image returned by embed
+k: number of bits per secret pixel
+
+return
+---------------
+the k-bit secret image
+'''
+def extract(stego, key, k):
+    assert k <= 8
+    low = (np.asarray(stego) & (2**k - 1)).astype(np.uint8)
+    return np.where(np.asarray(key) == 1, low, invert(low, k)).astype(np.uint8)
@@ -0,0 +1,336 @@
+'''
+Analytic resource estimates for the circuit builders, without building
+anything. Each estimator mirrors the loops of the builder it is named after
+(the per-pixel mcx loops of neqr, get_key and extract, the subtractor chains
+of difference, the ancilla-controlled mcx ladder of comparator) and counts
+in closed form, in O(log N) time for N pixels. Counts use the names
+count_ops gives to the built circuit, except that all mcx gates with three
+or more controls are counted as 'mcx' (qiskit names the widest ones
+'mcx_gray'). mcx gates with one or two controls are counted as cx and ccx,
+as QuantumCircuit.mcx appends them.
+
+Every estimate is a dict with one count per name in GATE_KEYS, plus:
+qubits: the width of a circuit holding only the registers the stage is
+given and the ones it adds
+depth: an upper bound on the depth, from the serial chains that set it:
+the per-pixel mcx loops (every mcx shares the index controls, with at most
+two layers of x flips between them), the borrow chain of the subtractors
+and the comparator's ladder
+max_controls: the widest mcx in the stage
+
+The builders are estimated without an ancilla pool. embed is not estimated.
+'''
+from collections import Counter
+
+GATE_KEYS = ('x', 'cx', 'ccx', 'mcx', 'h', 'id', 'swap', 'cswap', 'csx', 'csxdg', 'barrier')
+
+
+# add `number` mcx gates with `controls` controls to counts
+def _mcx(counts, controls, number=1):
+    if number <= 0:
+        return
+    counts[{1: 'cx', 2: 'ccx'}.get(controls, 'mcx')] += number
+    counts['max_controls'] = max(counts['max_controls'], controls)
+
+
+def _estimate(counts, qubits, depth):
+    estimate = {key: counts[key] for key in GATE_KEYS}
+    estimate['qubits'] = qubits
+    estimate['depth'] = depth
+    estimate['max_controls'] = counts['max_controls']
+    return estimate
+
+
+def _counts(estimate):
+    counts = Counter({key: estimate[key] for key in GATE_KEYS})
+    counts['max_controls'] = estimate['max_controls']
+    return counts
+
+
+def _combine(counts, *estimates):
+    for estimate in estimates:
+        max_controls = max(counts['max_controls'], estimate['max_controls'])
+        counts.update(_counts(estimate))
+        counts['max_controls'] = max_controls
+    return counts
+
+
+'''
+params
+---------------
+size: number of indices
+
+return
+---------------
+the total number of set bits in 0..size-1
+'''
+def popcount_sum(size):
+    total = 0
+    bit = 0
+    while (1 << bit) < size:
+        period = 1 << (bit + 1)
+        total += (size // period) * (period >> 1) + max(0, size % period - (period >> 1))
+        bit += 1
+    return total
+
+
+'''
+params
+---------------
+num_pixels: number of pixels
+
+return
+---------------
+the width of the position register
+'''
+def index_qubits(num_pixels):
+    return max(0, num_pixels - 1).bit_length()
+
+
+# x gates of a zero-controlled index loop: two per zero bit of every index
+def _index_flips(num_pixels, width):
+    return 2 * (width * num_pixels - popcount_sum(num_pixels))
+
+
+# depth of a zero-controlled index loop running `mcx` serial mcx gates: the
+# flips before and after every index with a zero bit (all but 2**width-1)
+# add a layer each
+def _index_loop_depth(num_pixels, width, mcx):
+    return mcx + 2 * (num_pixels - (num_pixels == 2**width))
+
+
+'''
+params
+---------------
+num_pixels: number of pixels in the image
+bit_depth: width of the intensity register
+ones: number of set intensity bits over the whole image, for an exact
+count; every bit set (the worst case) by default
+barriers: whether the image is built with barriers
+
+return
+---------------
+the estimate for neqr.neqr
+'''
+def neqr(num_pixels, bit_depth=8, ones=None, barriers=True):
+    n = index_qubits(num_pixels)
+    if ones is None:
+        ones = num_pixels * bit_depth
+    counts = Counter(id=bit_depth, h=n, x=_index_flips(num_pixels, n), barrier=num_pixels if barriers else 0, max_controls=0)
+    _mcx(counts, n, ones)
+    # the h and id layer, then the pixel loop
+    return _estimate(counts, n + bit_depth, 1 + _index_loop_depth(num_pixels, n, ones))
+
+
+'''
+params
+---------------
+length: width of the compared registers
+
+return
+---------------
+the estimate for steganography.comparator
+'''
+def comparator(length):
+    counts = Counter(x=8*length, cx=2, max_controls=0)
+    for index in range(length):
+        _mcx(counts, 2 + 2*index, 4 if index < length-1 else 2)
+    # the ladder: every bit's flags control all higher bits, five layers per
+    # bit (six for a single bit, with the x layers and the copy)
+    return _estimate(counts, 2*length + 2 + 2*length, max(5*length, 6))
+
+
+'''
+params
+---------------
+width: width of each coordinate register
+targets: width of the result register
+
+return
+---------------
+the estimate for steganography.coordinate_comparator
+'''
+def coordinate_comparator(width, targets=1):
+    counts = Counter(x=4*width, cx=2*width, max_controls=0)
+    _mcx(counts, width, targets)
+    # x, cx, x on each pair in parallel around the serial mcx gates; the
+    # second x, cx, x overlaps the mcx
+    return _estimate(counts, 2*width + targets, 5 + targets)
+
+
+# the complementary step shared by both differences: one mcx per bit with
+# the sign (and the control) and every higher difference bit as controls
+def _complement(counts, length, extra_controls):
+    for i in range(length):
+        _mcx(counts, extra_controls + length - 1 - i)
+
+
+'''
+params
+---------------
+length: width of the subtracted registers
+barriers: whether the subtractors are built with barriers
+
+return
+---------------
+the estimate for steganography.difference
+'''
+def difference(length, barriers=True):
+    counts = Counter(max_controls=0)
+    # one half subtractor and length-1 full subtractors
+    counts.update(csxdg=length, cx=2 + 3*(length-1), csx=2 + 3*(length-1), barrier=length if barriers else 0)
+    counts.update(swap=length, cx=length)
+    _complement(counts, length, 1)
+    # the borrow ripples from the last bit to the sign, three layers per bit
+    # plus two; barriers stop the blocks from overlapping, five layers for
+    # the half subtractor and six per full one. Then the swaps and the
+    # 2*length serial flips on the sign
+    chain = 5 + 6*(length-1) if barriers else 3*length + 2
+    return _estimate(counts, 3*length + length, chain + 1 + 2*length)
+
+
+'''
+params
+---------------
+length: width of the subtracted registers
+barriers: whether the subtractors are built with barriers
+
+return
+---------------
+the estimate for steganography.controlled_difference
+'''
+def controlled_difference(length, barriers=True):
+    counts = Counter(max_controls=0)
+    # controlled_rhs, then length-1 controlled_rfs
+    counts.update(ccx=5 + 4*(length-1), csxdg=length, csx=2 + 3*(length-1), cx=3*(length-1), barrier=length if barriers else 0)
+    counts.update(cswap=length, ccx=length)
+    _complement(counts, length, 2)
+    added = length + 3 + 4*(length-1)
+    # the control qubit is on nearly every gate, so the blocks hardly overlap
+    # even without barriers (seven layers per bit, less two), and with them
+    # take six and eight layers; then the cswaps and the serial sign flips
+    chain = 6 + 8*(length-1) if barriers else 7*length - 2
+    return _estimate(counts, 1 + 3*length + added, chain + 1 + 2*length)
+
+
+'''
+params
+---------------
+length: width of the intensity register
+
+return
+---------------
+the estimate for steganography.invert
+'''
+def invert(length):
+    return _estimate(Counter(x=2*length, cx=length, max_controls=0), 2*length, 3)
+
+
+'''
+params
+---------------
+num_pixels: number of pixels
+bit_depth: width of the intensity registers
+barriers: whether the differences are built with barriers
+
+return
+---------------
+the estimate for steganography.get_key (without Gray-code ordering)
+'''
+def get_key(num_pixels, bit_depth=8, barriers=True):
+    n = index_qubits(num_pixels)
+    counts = Counter(h=n, x=2 + _index_flips(num_pixels, n), max_controls=0)
+    _mcx(counts, 2 + n, num_pixels)
+    _combine(counts, difference(bit_depth, barriers), difference(bit_depth, barriers), comparator(bit_depth))
+    # key index and result, cover, secret, inverse, both differences, comparison
+    given = n + 1 + 5*bit_depth + 2
+    added = 2*bit_depth + 2*bit_depth
+    # the differences run side by side, the second one waiting two layers
+    # per block on the cover bits they share; the comparator waits on both,
+    # and the key loop (between two x gates) on the comparator
+    depth = (difference(bit_depth, barriers)['depth'] + 2 + comparator(bit_depth)['depth']
+             + 2 + _index_loop_depth(num_pixels, n, num_pixels))
+    return _estimate(counts, given + added, depth)
+
+
+'''
+params
+---------------
+num_pixels: number of pixels
+k: number of extracted bits
+bit_depth: width of the stego intensity register
+
+return
+---------------
+the estimate for steganography.extract (without Gray-code ordering)
+'''
+def extract(num_pixels, k, bit_depth=8):
+    n = index_qubits(num_pixels)
+    # extract walks every index of the stego position register
+    num_pixels = 2**n
+    # the key value is zero-controlled: one x before the loop and one after
+    counts = Counter(cx=k, x=2 + _index_flips(num_pixels, n), max_controls=0)
+    _combine(counts, coordinate_comparator(n))
+    _mcx(counts, 2 + n, k*num_pixels)
+    # key index and value, stego index and value, extracted bits, comparison
+    # the index loop starts once the comparator's first mcx is done, and the
+    # key value's last x follows it
+    depth = 5 + _index_loop_depth(num_pixels, n, k*num_pixels) + 1
+    return _estimate(counts, 2*n + 1 + bit_depth + k + 1, depth)
+
+
+'''
+params
+---------------
+num_pixels: number of pixels of the cover and secret
+bit_depth: width of the intensity registers
+ones: set intensity bits of (cover, secret), worst case by default
+
+return
+---------------
+the estimate for the whole key circuit of batch.build_key_circuit: both
+NEQR images, the inversion, get_key and the measurements, without barriers
+'''
+def key_circuit(num_pixels, bit_depth=8, ones=(None, None)):
+    n = index_qubits(num_pixels)
+    # build_key_circuit builds without the drawing barriers
+    cover = neqr(num_pixels, bit_depth, ones[0], barriers=False)
+    secret = neqr(num_pixels, bit_depth, ones[1], barriers=False)
+    key = get_key(num_pixels, bit_depth, barriers=False)
+    counts = _combine(Counter(max_controls=0), cover, secret, invert(bit_depth), key)
+    # the images are encoded side by side, the secret then inverted; get_key
+    # waits on both and the measurement layer on get_key
+    depth = max(cover['depth'], secret['depth'] + invert(bit_depth)['depth']) + key['depth'] + 1
+    estimate = _estimate(counts, 2*(n + bit_depth) + key['qubits'] - 2*bit_depth, depth)
+    estimate['measure'] = n + 1
+    return estimate
+
+
+_STAGES = {
+    'neqr': lambda num_pixels, k, bit_depth: neqr(num_pixels, bit_depth),
+    'difference': lambda num_pixels, k, bit_depth: difference(bit_depth),
+    'controlled_difference': lambda num_pixels, k, bit_depth: controlled_difference(bit_depth),
+    'comparator': lambda num_pixels, k, bit_depth: comparator(bit_depth),
+    'coordinate_comparator': lambda num_pixels, k, bit_depth: coordinate_comparator(index_qubits(num_pixels)),
+    'invert': lambda num_pixels, k, bit_depth: invert(bit_depth),
+    'get_key': lambda num_pixels, k, bit_depth: get_key(num_pixels, bit_depth),
+    'extract': lambda num_pixels, k, bit_depth: extract(num_pixels, k, bit_depth),
+    'key_circuit': lambda num_pixels, k, bit_depth: key_circuit(num_pixels, bit_depth),
+}
+
+
+'''
+params
+---------------
+stage: one of neqr, difference, controlled_difference, comparator,
+coordinate_comparator, invert, get_key, extract, key_circuit
+num_pixels: number of pixels of the image
+k: number of secret bits per pixel
+bit_depth: width of the intensity registers
+
+return
+---------------
+the estimate for that stage (worst case for NEQR images)
+'''
+def estimate(stage, num_pixels, k=1, bit_depth=8):
+    return _STAGES[stage](num_pixels, k, bit_depth)
@@ -0,0 +1,288 @@
+'''
+Content-addressed cache of pipeline artifacts. Everything is keyed by a
+hash of the image contents (and k), never by object identity, so retried
+(cover, secret, k) triples and covers reused against new secrets hit the
+cache. Artifacts are kept in three tiers, each with its own size bound and
+least recently used eviction:
+
+bits: convert_to_bit_array results
+circuits: NEQR and key circuits, stored as QPY
+results: key, stego and extracted images
+
+Tiers live in memory and, when a directory is given, are also written to
+disk so other processes and later runs share them. NEQR circuits are cached
+per image, so a key circuit for a cover that was encoded before only builds
+the secret-dependent stages.
+'''
+import hashlib
+import io
+import math
+import os
+from collections import OrderedDict
+
+import numpy as np
+from qiskit import QuantumRegister
+from qiskit import qpy
+
+import batch
+import neqr
+import reference
+import transpile_cache
+
+# default bound on the size of each tier, in memory and on disk
+TIER_MAX_BYTES = {'bits': 64 * 2**20, 'circuits': 256 * 2**20, 'results': 64 * 2**20}
+
+
+'''
+params
+---------------
+parts: arrays, numbers (Python or numpy) or strings
+
+return
+---------------
+a hex digest of the parts' contents; arrays hash their shape and values,
+widened to int64 (float64 for non-integer arrays), so equal images give
+equal keys whatever object or dtype holds them
+'''
+def content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if np.ndim(part) == 0:
+            # numpy scalars and 0-d arrays hash like the Python number they hold
+            part = np.asarray(part).item()
+        if isinstance(part, (str, int, float)):
+            digest.update(repr(part).encode())
+        else:
+            array = np.asarray(part)
+            array = np.ascontiguousarray(array, dtype=np.int64 if array.dtype.kind in 'biu' else np.float64)
+            digest.update(repr(array.shape).encode())
+            digest.update(array.tobytes())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+def _dump_circuit(circuit):
+    buffer = io.BytesIO()
+    qpy.dump(circuit, buffer)
+    return buffer.getvalue()
+
+
+def _dump_arrays(arrays):
+    buffer = io.BytesIO()
+    np.savez(buffer, *arrays)
+    return buffer.getvalue()
+
+
+def _load_arrays(data):
+    with np.load(io.BytesIO(data)) as arrays:
+        return tuple(arrays[f'arr_{i}'] for i in range(len(arrays.files)))
+
+
+'''
+One tier: serialized entries in an LRU ordered dict, mirrored to files in
+directory when one is given, written and evicted like TranspileCache's.
+
+params
+---------------
+max_bytes: bound on the total size of the entries
+directory: optional on-disk backing, created if missing
+'''
+class Tier:
+    def __init__(self, max_bytes, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.bin')
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.directory is not None and os.path.exists(self._path(key)):
+            os.utime(self._path(key))
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+            self.hits += 1
+            self._remember(key, data)
+            return data
+        self.misses += 1
+        return None
+
+    def put(self, key, data):
+        self._remember(key, data)
+        if self.directory is not None:
+            transpile_cache.write_atomic(self._path(key), data)
+            transpile_cache.evict(self.directory, '.bin', self.max_bytes)
+
+    def _remember(self, key, data):
+        if key in self.entries:
+            self.bytes -= len(self.entries.pop(key))
+        self.entries[key] = data
+        self.bytes += len(data)
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'bytes': self.bytes}
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+        if self.directory is not None:
+            for _, _, path in transpile_cache.disk_entries(self.directory, '.bin'):
+                os.remove(path)
+
+
+'''
+params
+---------------
+directory: optional directory for on-disk backing, one subdirectory per tier
+max_bytes: {tier: bound}, overriding TIER_MAX_BYTES per tier
+'''
+class ResultCache:
+    def __init__(self, directory=None, max_bytes=None):
+        limits = {**TIER_MAX_BYTES, **(max_bytes or {})}
+        self.tiers = {name: Tier(limit, None if directory is None else os.path.join(directory, name))
+                      for name, limit in limits.items()}
+
+    def _arrays(self, tier, key, compute):
+        data = self.tiers[tier].get(key)
+        if data is not None:
+            return _load_arrays(data)
+        arrays = compute()
+        arrays = arrays if isinstance(arrays, tuple) else (arrays,)
+        self.tiers[tier].put(key, _dump_arrays(arrays))
+        return arrays
+
+    def _circuit(self, key, build):
+        data = self.tiers['circuits'].get(key)
+        if data is not None:
+            return qpy.load(io.BytesIO(data))[0]
+        # the same form a hit loads
+        circuit = transpile_cache.plain_registers(build())
+        self.tiers['circuits'].put(key, _dump_circuit(circuit))
+        return circuit
+
+    '''
+    params
+    ---------------
+    image: 2d array of grayscale values
+    bit_depth: bits per value
+
+    return
+    ---------------
+    neqr.convert_to_bit_array(image, bit_depth)
+    '''
+    def bits(self, image, bit_depth=8):
+        key = content_hash('bits', image, bit_depth)
+        return self._arrays('bits', key, lambda: neqr.convert_to_bit_array(image, bit_depth))[0]
+
+    '''
+    params
+    ---------------
+    image: square 2d array of 8-bit grayscale values, side a power of 2
+
+    return
+    ---------------
+    a fresh copy of the image's NEQR circuit, on an 'intensity' then an
+    'idx' register, without the drawing barriers
+    '''
+    def neqr_circuit(self, image):
+        def build():
+            num_idx = int(math.log2(np.size(image)))
+            idx, intensity = QuantumRegister(num_idx, 'idx'), QuantumRegister(8, 'intensity')
+            return neqr.build_neqr(self.bits(image), idx, intensity, barriers=False)
+        return self._circuit(content_hash('neqr', image), build)
+
+    '''
+    params
+    ---------------
+    cover: square 2d array of 8-bit cover values
+    secret: secret image of the same size
+
+    return
+    ---------------
+    a fresh copy of batch.build_key_circuit's circuit for the pair; the
+    cover and secret NEQR sub-circuits come from the cache, so a known
+    cover only costs the secret-dependent stages
+    '''
+    def key_circuit(self, cover, secret):
+        def build():
+            num_pixels = np.size(cover)
+            circuit, registers = batch.key_circuit_layout(num_pixels)
+            # cached sub-circuits are on (intensity, idx)
+            for image, name in [(cover, 'cover'), (secret, 'secret')]:
+                qubits = registers[f'{name}_intensity'][:] + registers[f'{name}_idx'][:]
+                circuit.compose(self.neqr_circuit(image), qubits=qubits, inplace=True)
+            batch.append_key_stages(circuit, registers, num_pixels)
+            return circuit
+        return self._circuit(content_hash('key_circuit', cover, secret), build)
+
+    '''
+    params
+    ---------------
+    cover: 8-bit cover image
+    secret: k-bit secret image, same shape
+    k: bits per secret pixel
+    kernel: the key computation, reference.get_key by default
+
+    return
+    ---------------
+    the key image, computed once per distinct (cover, secret, k)
+    '''
+    def get_key(self, cover, secret, k, kernel=reference.get_key):
+        key = content_hash('get_key', cover, secret, k, kernel.__module__ + '.' + kernel.__qualname__)
+        return self._arrays('results', key, lambda: kernel(cover, secret, k))[0]
+
+    '''
+    params
+    ---------------
+    cover: 8-bit cover image
+    secret: k-bit secret image, same shape
+    k: bits per secret pixel
+    kernel: the embedding, reference.embed by default
+
+    return
+    ---------------
+    (stego, key), computed once per distinct (cover, secret, k)
+    '''
+    def embed(self, cover, secret, k, kernel=reference.embed):
+        key = content_hash('embed', cover, secret, k, kernel.__module__ + '.' + kernel.__qualname__)
+        return self._arrays('results', key, lambda: tuple(kernel(cover, secret, k)))
+
+    '''
+    params
+    ---------------
+    stego: stego image
+    key: key image
+    k: bits per secret pixel
+    kernel: the extraction, reference.extract by default
+
+    return
+    ---------------
+    the extracted secret, computed once per distinct (stego, key, k)
+    '''
+    def extract(self, stego, key, k, kernel=reference.extract):
+        cache_key = content_hash('extract', stego, key, k, kernel.__module__ + '.' + kernel.__qualname__)
+        return self._arrays('results', cache_key, lambda: kernel(stego, key, k))[0]
+
+    '''
+    return
+    ---------------
+    {tier: hits, misses, entries and bytes held in memory}
+    '''
+    def stats(self):
+        return {name: tier.stats() for name, tier in self.tiers.items()}
+
+    def clear(self):
+        for tier in self.tiers.values():
+            tier.clear()
@@ -0,0 +1,122 @@
+'''
+Adaptive shot allocation for reading per-pixel values (the key result, or
+the extracted secret planes) out of a uniform superposition over pixel
+indices. Instead of a fixed shot count, the circuit is compiled once and
+run in growing chunks; votes are tallied per (pixel, value), and sampling
+stops as soon as every pixel has either been seen enough times for one value
+to clearly lead, or enough times to tell that its top two values are about
+equally likely (a genuinely mixed readout, which more shots cannot decide),
+or when the shot budget runs out.
+'''
+import math
+
+import numpy as np
+
+import backends
+import readout
+
+# default shot budget, as a multiple of readout.neqr_shots(num_pixels)
+SHOT_BUDGET = 16
+
+
+'''
+params
+---------------
+votes: (pixels, values) array of vote counts
+min_votes: fewest samples of a pixel before it can be decided
+z: how many standard deviations the leading value must lead the runner-up
+by, in a sign test between the two
+
+return
+---------------
+(values, decided): the leading value of every pixel, and whether it is
+decided
+'''
+def decide(votes, min_votes=3, z=2.0):
+    ordered = np.sort(votes, axis=1)
+    top = ordered[:, -1]
+    second = ordered[:, -2] if votes.shape[1] > 1 else np.zeros_like(top)
+    seen = votes.sum(axis=1)
+    lead = top - second
+    decided = (seen >= min_votes) & (lead >= z * np.sqrt(top + second))
+    return votes.argmax(axis=1), decided
+
+
+'''
+params
+---------------
+votes: (pixels, values) array of vote counts
+tolerance: how far from an even split the leading value's share of the top
+two values may be for the pixel to count as mixed
+z: confidence of the bound on that share, in standard deviations
+
+return
+---------------
+bool mask of the pixels whose top two values are indistinguishable: with
+confidence z, the leading value's share of their votes is at most
+0.5 + tolerance
+'''
+def mixed(votes, tolerance=0.2, z=2.0):
+    ordered = np.sort(votes, axis=1)
+    top = ordered[:, -1]
+    second = ordered[:, -2] if votes.shape[1] > 1 else np.zeros_like(top)
+    pair = top + second
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = top / pair
+        # the binomial standard deviation is largest at an even split
+        bound = share + z * 0.5 / np.sqrt(pair)
+    return (pair > 0) & (bound <= 0.5 + tolerance)
+
+
+'''
+params
+---------------
+circuit: a circuit with the index and value registers measured
+index: the pixel index register, in uniform superposition
+value: the register holding each pixel's value (key result, extracted bits)
+min_votes, z: passed to decide
+tolerance: passed to mixed, with z
+initial_shots: size of the first chunk; by default enough to see every
+pixel at least once with 99% probability
+growth: factor each following chunk grows by
+max_shots: shot budget, SHOT_BUDGET * readout.neqr_shots(num_pixels) by
+default
+seed: simulator seed of the first chunk, incremented per chunk
+options: passed to backends.prepare
+
+return
+---------------
+{'values': leading value per pixel, 'decided': bool mask of decided pixels,
+'mixed': bool mask of undecided pixels found to be mixed, 'votes': (pixels, 2**len(value)) vote counts, 'shots': shots used,
+'chunks': number of runs}
+'''
+def sample(circuit, index, value, min_votes=3, z=2.0, tolerance=0.2, initial_shots=None, growth=2,
+           max_shots=None, seed=None, **options):
+    num_pixels = 2**len(index)
+    max_shots = max_shots or SHOT_BUDGET * readout.neqr_shots(num_pixels)
+    layout = readout.RegisterLayout(circuit)
+    missing = [reg.name for reg in (index, value) if reg.name not in layout.measured_fields]
+    assert not missing, f'registers {missing} are not measured'
+
+    backend, compiled = backends.prepare(circuit, **options)
+    votes = np.zeros((num_pixels, 2**len(value)), dtype=np.int64)
+    chunk = initial_shots or max(readout.neqr_shots(num_pixels), min_votes * num_pixels)
+    shots = chunks = 0
+    while True:
+        chunk = min(chunk, max_shots - shots)
+        run_options = {} if seed is None else {'seed_simulator': seed + chunks}
+        counts = backend.run(compiled, shots=chunk, **run_options).result().get_counts()
+        decoded = layout.decode_counts(counts, [index.name, value.name])
+        pixels = decoded[index.name].astype(np.int64)
+        measured = decoded[value.name].astype(np.int64)
+        np.add.at(votes, (pixels, measured), decoded['counts'])
+        shots += chunk
+        chunks += 1
+
+        values, decided = decide(votes, min_votes, z)
+        undecidable = mixed(votes, tolerance, z) & ~decided
+        if (decided | undecidable).all() or shots >= max_shots:
+            break
+        chunk = math.ceil(chunk * growth)
+
+    return {'values': values, 'decided': decided, 'mixed': undecidable, 'votes': votes, 'shots': shots, 'chunks': chunks}
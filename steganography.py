@@ -1,56 +1,13 @@
-import qiskit
-from qiskit import QuantumCircuit, ClassicalRegister, QuantumRegister, AncillaRegister
-from qiskit import execute
-from qiskit import Aer
-from qiskit import IBMQ
-from qiskit.compiler import transpile
-from time import perf_counter
-from qiskit.tools.visualization import plot_histogram
-from qiskit.circuit.library import SXdgGate
+from qiskit import QuantumRegister
 
 
 import numpy as np
 import neqr
-import random
-import math
-
-'''
-params
----------------
-regY: a quantum register
-regX: a quantum register
-circuit: the circuit that contains all the register
-result: an empty register that will hold results
-
-return
----------------
-a size 2 register, c0 c1:
-If c1c0 = 00, then Y = X.
-If c1c0 = 01, then Y < X.
-If c1c0 = 10, then Y > X
-'''
-def comparator(regY, regX, circuit, result): 
-    # regX and regY should have the same size 
-    regLength = regX.size 
-    ancilla = AncillaRegister(2*regLength)
-    circuit.add_register(ancilla)
-
-    circuit.x(ancilla)
-    for index in range(regLength):
-        circuit.x(regX[index])
-        circuit.mcx([regY[index], regX[index]]+[ancilla[i] for i in range(2*index)], [ancilla[index*2]])
-        if index < regLength-1: 
-            circuit.mcx([regY[index], regX[index]]+[ancilla[i] for i in range(2*index)], [ancilla[2*regLength-2]])
-        circuit.x(regX[index])
-        circuit.x(regY[index])
-        circuit.mcx([regY[index], regX[index]]+[ancilla[i] for i in range(2*index)], [ancilla[index*2+1]])
-        if index < regLength-1: 
-            circuit.mcx([regY[index], regX[index]]+[ancilla[i] for i in range(2*index)], [ancilla[2*regLength-1]])
-        circuit.x(regY[index])     
-    circuit.x(ancilla)
-
-    circuit.cx(ancilla[2*regLength-2], result[0])
-    circuit.cx(ancilla[2*regLength-1], result[1])
+import instrument
+import reference
+import templates
+# the arithmetic blocks live in a leaf module that templates imports too
+from arithmetic import CSXDG_GATE, comparator, comparator_core, difference, rev_half_subtractor, rev_full_subtractor
 
 
 '''
@@ -63,6 +20,7 @@ return
 ---------------
 A single qubit |r> which is |1> when YX = AB and |0> otherwise
 '''
+@instrument.stage()
 def coordinate_comparator(circuit, result, YX, AB):
     assert len(YX) == len(AB)
     n = YX.size
@@ -80,122 +38,36 @@ def coordinate_comparator(circuit, result, YX, AB):
         circuit.x(YX[i])
 
 
-'''
-params
----------------
-Y: a quantum register
-X: a quantum register
-difference: an empty quantum register the same size as X and Y
-
-return
----------------
-A quantum register |D> which holds the positive difference of Y and X.
-'''
-def difference(circuit, Y, X, difference):
-    assert len(Y) == len(X)
-    # PART 1: 
-    # reversible parallel subtractor
-    
-    # initialize registers to store sign, difference, and junk qubits
-    regLength = X.size
-    sign = QuantumRegister(1)
-    ancilla = QuantumRegister(regLength - 1)
-    circuit.add_register(ancilla)
-    circuit.add_register(sign)
-
-    # perform half subtractor for last qubit
-    rev_half_subtractor(circuit, X[-1], Y[-1], difference[-1], ancilla[-1])
-    
-    # perform full subtrator for rest of qubits
-    for i in range(regLength - 2, 0, -1): 
-        rev_full_subtractor(circuit, X[i], Y[i], ancilla[i], difference[i], ancilla[i-1])
-    rev_full_subtractor(circuit, X[0], Y[0], ancilla[0], difference[0], sign[0])
-    
-    # swap X and difference registers to fix result 
-    # this is just sort of a thing you have to do
-    for i in range(regLength - 1, -1, -1): 
-        circuit.swap(difference[i], X[i])
-    
-    # PART 2: 
-    # complementary operation
-
-    # flip the difference based on the sign (pt 1)
-    for i in range(regLength): 
-        circuit.cx(sign[0], difference[i])
-    
-    # flip the difference again, but based on sign and remaining bits (pt 2)
-    #for i in range(regLength-1, -1, -1):
-    for i in range(regLength):
-        circuit.mcx([sign[0]] + difference[i+1:], difference[i])
-    
-
-
-
-'''
-params
----------------
-regA: a quantum register, one of the numbers being subtracted
-regB: a quantum register, one of the numbers being subtracted
-Q: Updated depending on result
-Borrow: Digit to be carried over
-
-return
----------------
-Performs A - B, and updates results into Q and Borrow 
-'''
-def rev_half_subtractor(circuit, A, B, Q, Borrow): 
-    csxdg_gate = SXdgGate().control()
-    circuit.append(csxdg_gate, [A, Borrow])
-    circuit.cx(A, Q)
-    circuit.cx(B, A)
-    circuit.csx(B, Borrow)
-    circuit.csx(A, Borrow)
-    circuit.barrier()
-    
-    
-'''
-params
----------------
-regA: a quantum register, one of the numbers being subtracted
-regB: a quantum register, one of the numbers subtracting
-regC: a quantum register, one of the numbers subtracting
-Q: Updated depending on result
-Borrow: Digit to be carried over
-
-return
----------------
-Performs A - B - C, updates results into Q and Borrow
-'''
-def rev_full_subtractor(circuit, A, B, C, Q, Borrow): 
-    csxdg_gate = SXdgGate().control()
-    circuit.append(csxdg_gate, [A, Borrow])
-    circuit.cx(A, Q)
-    circuit.cx(B, A)
-    circuit.csx(B, Borrow)
-    circuit.cx(C, A)
-    circuit.csx(C, Borrow)
-    circuit.csx(A, Borrow)
-    circuit.barrier()
 
 
-def controlled_difference(controlled_qubit, circuit, Y, X, difference): 
+@instrument.stage()
+def controlled_difference(controlled_qubit, circuit, Y, X, difference, pool=None, barriers=True): 
     # PART 1: 
     # reversible parallel subtractor
     
+    # least significant bit first, as in difference
+    Y, X, difference = Y[::-1], X[::-1], difference[::-1]
+
     # initialize registers to store sign, difference, and junk qubits
-    regLength = X.size
-    sign = QuantumRegister(1, 'sign')
-    ancilla = QuantumRegister(regLength - 1, 'junk')
-    circuit.add_register(ancilla)
-    circuit.add_register(sign)
+    regLength = len(X)
+    if pool is None:
+        sign = QuantumRegister(1, 'sign')
+        ancilla = QuantumRegister(regLength - 1, 'junk')
+        circuit.add_register(ancilla)
+        circuit.add_register(sign)
+    else:
+        sign = pool.acquire(1)
+        ancilla = pool.acquire(regLength - 1)
 
     # perform half subtractor for last qubit
-    controlled_rhs(controlled_qubit, circuit, X[-1], Y[-1], difference[-1], ancilla[-1])
+    borrow = ancilla[-1] if regLength > 1 else sign[0]
+    controlled_rhs(controlled_qubit, circuit, X[-1], Y[-1], difference[-1], borrow, pool=pool, barriers=barriers)
     
     # perform full subtrator for rest of qubits
     for i in range(regLength - 2, 0, -1): 
-        controlled_rfs(controlled_qubit, circuit, X[i], Y[i], ancilla[i], difference[i], ancilla[i-1])
-    controlled_rfs(controlled_qubit, circuit, X[0], Y[0], ancilla[0], difference[0], sign[0])
+        controlled_rfs(controlled_qubit, circuit, X[i], Y[i], ancilla[i], difference[i], ancilla[i-1], pool=pool, barriers=barriers)
+    if regLength > 1:
+        controlled_rfs(controlled_qubit, circuit, X[0], Y[0], ancilla[0], difference[0], sign[0], pool=pool, barriers=barriers)
     
     # swap X and difference registers to fix result 
     # this is just sort of a thing you have to do
@@ -216,33 +88,49 @@ def controlled_difference(controlled_qubit, circuit, Y, X, difference):
     
 
 # controlled reversible half subtractor
-def controlled_rhs(controlled_qubit, circuit, A, B, Q, Borrow): 
+# with a pool, the scratch ancillas are uncomputed and handed back
+def controlled_rhs(controlled_qubit, circuit, A, B, Q, Borrow, pool=None, barriers=True): 
     # allocate ancilla qubits
-    anc1 = QuantumRegister(3)
-    circuit.add_register(anc1)
+    if pool is None:
+        anc1 = QuantumRegister(3)
+        circuit.add_register(anc1)
+    else:
+        anc1 = pool.acquire(3)
 
     # rewritten code to control for given qubit
-    csxdg_gate = SXdgGate().control()
     circuit.ccx(controlled_qubit, A, anc1[0])
-    circuit.append(csxdg_gate, [anc1[0], Borrow])
+    circuit.append(CSXDG_GATE, [anc1[0], Borrow])
     circuit.ccx(controlled_qubit, A, Q)
     circuit.ccx(controlled_qubit, B, A)
     circuit.ccx(controlled_qubit, B, anc1[1])
     circuit.ccx(controlled_qubit, A, anc1[2])
     circuit.csx(anc1[1], Borrow)
     circuit.csx(anc1[2], Borrow)
-    circuit.barrier()
+
+    if pool is not None:
+        # uncompute, temporarily restoring A to recompute anc1[0]
+        circuit.ccx(controlled_qubit, A, anc1[2])
+        circuit.ccx(controlled_qubit, B, anc1[1])
+        circuit.ccx(controlled_qubit, B, A)
+        circuit.ccx(controlled_qubit, A, anc1[0])
+        circuit.ccx(controlled_qubit, B, A)
+        pool.release(anc1)
+    if barriers:
+        circuit.barrier()
 
 # controlled reversible full subtractor
-def controlled_rfs(controlled_qubit, circuit, A, B, C, Q, Borrow): 
+# with a pool, the scratch ancillas are uncomputed and handed back
+def controlled_rfs(controlled_qubit, circuit, A, B, C, Q, Borrow, pool=None, barriers=True): 
     # allocate ancilla qubits
-    anc2 = QuantumRegister(4)
-    circuit.add_register(anc2)
+    if pool is None:
+        anc2 = QuantumRegister(4)
+        circuit.add_register(anc2)
+    else:
+        anc2 = pool.acquire(4)
     
     # rewritten code to control for given qubit
-    csxdg_gate = SXdgGate().control()
     circuit.ccx(controlled_qubit, A, anc2[0])
-    circuit.append(csxdg_gate, [anc2[0], Borrow])
+    circuit.append(CSXDG_GATE, [anc2[0], Borrow])
     circuit.cx(A, Q)
     circuit.cx(B, A)
     circuit.ccx(controlled_qubit, B, anc2[1])
@@ -252,7 +140,20 @@ def controlled_rfs(controlled_qubit, circuit, A, B, C, Q, Borrow):
     circuit.csx(anc2[2], Borrow)
     circuit.ccx(controlled_qubit, A, anc2[3])
     circuit.csx(anc2[3], Borrow)
-    circuit.barrier()
+
+    if pool is not None:
+        # uncompute, temporarily restoring A to recompute anc2[0]
+        circuit.ccx(controlled_qubit, A, anc2[3])
+        circuit.ccx(controlled_qubit, C, anc2[2])
+        circuit.ccx(controlled_qubit, B, anc2[1])
+        circuit.cx(C, A)
+        circuit.cx(B, A)
+        circuit.ccx(controlled_qubit, A, anc2[0])
+        circuit.cx(B, A)
+        circuit.cx(C, A)
+        pool.release(anc2)
+    if barriers:
+        circuit.barrier()
 
 '''
 Embedding Procedure
@@ -262,21 +163,38 @@ Embedding Procedure
 params
 ------------------
 k: the number of binary images
-binary_images: a list of 2^n by 2^n binary images to construct the secret image
-assume they are all the same size
+binary_images: k (or more, the first k are used) binary images of the same
+shape, any number of rows and columns; a (..., k, rows, cols) array for a
+batch of secret images
 
 return
 -------------------
-the secret image
+the secret image as a (..., rows, cols) array of k-bit values, the first
+binary image being the most significant bit; uint8 for k up to 8, uint16
+beyond
 '''
 def get_secret_image(k, binary_images):
-    n = len(binary_images[0][0])
-    secret_image = [['' for i in range(n)] for j in range(n)]
-    for i in range(k):
-        for j in range(n):
-            for l in range(n):
-                secret_image[j][l] += str(binary_images[i][j][l])
-    return secret_image
+    planes = np.asarray(binary_images)[..., :k, :, :]
+    return reference.secret_image(planes)
+
+
+'''
+params
+------------------
+k: the number of binary images
+binary_images: k (or more) binary images of the same shape; a
+(..., k, rows, cols) array for a batch of secret images
+
+return
+-------------------
+the secret image's (..., rows*cols, k) bit array, most significant bit
+first, as convert_to_bit_array(get_secret_image(k, binary_images), bit_depth=k)
+gives it, ready for the NEQR encoders with a k qubit intensity register;
+the planes are transposed directly without packing them first
+'''
+def get_secret_bits(k, binary_images):
+    planes = np.asarray(binary_images, dtype=np.uint8)[..., :k, :, :]
+    return np.swapaxes(planes.reshape(planes.shape[:-2] + (-1,)), -1, -2)
 
 
 '''
@@ -289,6 +207,7 @@ returns
 --------------------
 nothing
 '''
+@instrument.stage()
 def invert(secret_image, intensity, inverse):
     secret_image.x(intensity)
     for i in range(len(intensity)):
@@ -308,7 +227,15 @@ image_size: total size of the image
 diff1: holds difference between cover and secret
 diff2: holds difference between cover and inverse secret
 image_size: number of pixels
+gray_code: visit the key indices in Gray-code order, toggling one index bit per step
+barriers: keep the barriers between subtractor blocks, for drawing
+pool: optional ancilla.AncillaPool for the differences and the comparator;
+the comparator's ancillas are uncomputed and handed back, for later stages
+of the same circuit to reuse
+use_templates: append the differences and the comparator as cached
+instructions from templates instead of gate by gate; not with a pool
 '''
+@instrument.stage()
 def get_key(circuit, 
             key_idx, 
             key_result,
@@ -318,116 +245,175 @@ def get_key(circuit,
             diff1, 
             diff2, 
             comp_result,
-            image_size):
+            image_size,
+            gray_code=False,
+            barriers=True,
+            pool=None,
+            use_templates=False):
 
     circuit.h(key_idx)
 
-    difference(circuit, cover_intensity, secret_intensity, diff1)
-    difference(circuit, cover_intensity, inv_secret_intensity, diff2)
-
-    comparator(diff1, diff2, circuit, comp_result)
+    if use_templates:
+        assert pool is None, 'templates allocate their own scratch registers'
+        templates.append_difference(circuit, cover_intensity, secret_intensity, diff1, barriers=barriers)
+        templates.append_difference(circuit, cover_intensity, inv_secret_intensity, diff2, barriers=barriers)
+        templates.append_comparator(circuit, diff1, diff2, comp_result)
+    else:
+        difference(circuit, cover_intensity, secret_intensity, diff1, pool=pool, barriers=barriers)
+        difference(circuit, cover_intensity, inv_secret_intensity, diff2, pool=pool, barriers=barriers)
+        comparator(diff1, diff2, circuit, comp_result, pool=pool)
 
     circuit.x(comp_result[1])
 
-    for i in range(image_size):
-        bin_ind = bin(i)[2:]
-        bin_ind = (len(key_idx) - len(bin_ind)) * '0' + bin_ind
-        bin_ind = bin_ind[::-1]
-
-        # X-gate (enabling zero-controlled nature)
-        for j in range(len(bin_ind)):
-            if bin_ind[j] == '0':
-                circuit.x(key_idx[j])
-
-        circuit.mcx(comp_result[:] + key_idx[:], key_result)
+    if gray_code:
+        neqr.walk_indices(circuit, key_idx, neqr.gray_code_order(image_size),
+                          lambda i: circuit.mcx(comp_result[:] + key_idx[:], key_result))
+    else:
+        for i in range(image_size):
+            bin_ind = bin(i)[2:]
+            bin_ind = (len(key_idx) - len(bin_ind)) * '0' + bin_ind
+            bin_ind = bin_ind[::-1]
+
+            # X-gate (enabling zero-controlled nature)
+            for j in range(len(bin_ind)):
+                if bin_ind[j] == '0':
+                    circuit.x(key_idx[j])
+
+            circuit.mcx(comp_result[:] + key_idx[:], key_result)
         
-        # X-gate (enabling zero-controlled nature)
-        for j in range(len(bin_ind)):
-            if bin_ind[j] == '0':
-                circuit.x(key_idx[j])
+            # X-gate (enabling zero-controlled nature)
+            for j in range(len(bin_ind)):
+                if bin_ind[j] == '0':
+                    circuit.x(key_idx[j])
 
     circuit.x(comp_result[1])
 
-def embed(circuit, C, S, Key, cover_image_values, secret_image_values, key_i):
-    # removed code. can be used for unit test
-    '''
-    #preperation
-    array = [[random.randint(0, 255), random.randint(0, 255)], [random.randint(0, 255), random.randint(0, 255)]]
-    print(array)
-    bits_array = neqr.convert_to_bits(array)
-    print(bits_array)
-
-    #setting up the images, difference registers, and circuiit
-    _, cover_image_values = neqr.neqr(bits_array)
-    _, secret_image_values = neqr.neqr(bits_array)
-    circuit = QuantumCircuit(cover_image_values, secret_image_values, difference_1, difference_2)
-    '''
+
+'''
+params
+------------------
+circuit: the quantum circuit containing all the images
+C: position register of the cover image
+S: position register of the secret image
+Key: position register of the key image
+cover_image_values: the cover's intensity register, qubit 0 the least
+significant bit
+secret_image_values: the secret's k qubit intensity register
+key_i: the key image's one qubit value register, to be modified
+pool: optional ancilla.AncillaPool for the differences, the comparator and
+the swap controls
+
+return
+------------------
+nothing; where C = S, the k low qubits of the cover are swapped with the
+secret where they are strictly closer to it than to the inverse secret,
+and with the inverse secret otherwise, and where C = S = Key the first
+case sets key_i; the cover then holds reference.embed's stego values
+'''
+@instrument.stage()
+def embed(circuit, C, S, Key, cover_image_values, secret_image_values, key_i, pool=None):
+    k = len(secret_image_values)
+    low = cover_image_values[:k]
+
     #part 1:
     #carrying out the coordinate comparators 
     coord_result = QuantumRegister(2, 'coord_result')
     circuit.add_register(coord_result)
-    coordinate_comparator(circuit, coord_result, C, S)
-
-    #getting the key through getKey (once its done)
-    coordinate_comparator(circuit, coord_result, C, Key)
-
-    #adding outputs to the circuit 
-    circuit.add_register(coord_result[0])
-    circuit.add_register(coord_result[1])
+    coordinate_comparator(circuit, coord_result[0], C, S)
+    coordinate_comparator(circuit, coord_result[1], C, Key)
 
     #part 2: 
-    #need to make a controlled difference method :(
-    diff1_result = QuantumRegister(C.size, 'diff1_result')
-    circuit.add_register(diff1_result)
-    controlled_difference(coord_result[0], circuit, cover_image_values, secret_image_values, diff1_result)
-
-    #after this, secret_image_values are inverted 
-    invert(circuit, secret_image_values)
-    #computing difference again
-    diff2_result = QuantumRegister(C.size, 'diff2_result')
-    circuit.add_register(diff2_result)
-    difference(circuit,cover_image_values, secret_image_values, diff2_result)
-
-    #comparing the differences
-    comparator_result = QuantumRegister(2, "compare_result")
-    circuit.add_register(comparator_result)
-    comparator(circuit, diff2_result, diff1_result, comparator_result)
-
-    # flip for zero-controlled ccnots
+    #the key, as get_key computes it
+    inverse = QuantumRegister(k, 'inverse')
+    diff1_result = QuantumRegister(k, 'diff1_result')
+    diff2_result = QuantumRegister(k, 'diff2_result')
+    comparator_result = QuantumRegister(2, 'compare_result')
+    for register in [inverse, diff1_result, diff2_result, comparator_result]:
+        circuit.add_register(register)
+    invert(circuit, secret_image_values, inverse)
+    difference(circuit, low, secret_image_values, diff1_result, pool=pool)
+    difference(circuit, low, inverse, diff2_result, pool=pool)
+    comparator(diff1_result, diff2_result, circuit, comparator_result, pool=pool)
+
+    #part 3:
+    # anc[0] holds the key (comparator result 01), anc[1] the swap control
+    if pool is None:
+        anc = QuantumRegister(2) # allocate ancilla qubits
+        circuit.add_register(anc)
+    else:
+        anc = pool.acquire(2)
+    circuit.x(comparator_result[1])
+    circuit.ccx(comparator_result[0], comparator_result[1], anc[0])
+
+    # swap in the secret where the key is 1, then the inverse where it is 0
+    for values in [secret_image_values, inverse]:
+        circuit.ccx(coord_result[0], anc[0], anc[1])
+        for i in range(k):
+            circuit.cswap(anc[1], low[i], values[i])
+        circuit.ccx(coord_result[0], anc[0], anc[1])
+        circuit.x(anc[0])
+    circuit.mcx([coord_result[0], coord_result[1], anc[0]], key_i)
+
+    # undo the key flag; the ancillas are clean again
+    circuit.ccx(comparator_result[0], comparator_result[1], anc[0])
     circuit.x(comparator_result[1])
-    circuit.ccx(coord_result[0], comparator_result[1], cover_image_values)
-    circuit.ccx(coord_result[0], comparator_result[1], secret_image_values)
-    circuit.x(comparator_result[1]) # flip back
+    if pool is not None:
+        pool.release(anc)
 
-    # do a cute little toffoli cascade for the cccswap and cccx
-    anc = QuantumRegister(2) # allocate ancilla qubits
-    circuit.add_register(anc)
-    circuit.ccx(coord_result[0], coord_result[1], anc[0])
-    circuit.ccx(anc[0], comparator_result[1], anc[1])
-    circuit.cswap(anc[2], cover_image_values, secret_image_values) # cccswap
-    circuit.cx(comparator_result[1], key_i) # cccnot
 
+'''
+params
+------------------
+circuit: the quantum circuit containing the key and stego images
+key_idx: position register of the key image
+key_val: the key image's one qubit value register
+cs_idx: position register of the stego image
+cs_val: the stego image's intensity register, qubit 0 the least significant
+bit
+extracted: a k qubit register, to be modified
+comp_result: a one qubit register for the coordinate comparison
+k: number of extracted bits
+gray_code: visit the stego indices in Gray-code order
 
-def extract(circuit, key_idx, key_val, cs_idx, cs_val, extracted, comp_result, k):
+return
+------------------
+nothing; extracted holds the k low bits of the stego value, inverted where
+key_idx = cs_idx and the key is 0, as reference.extract
+'''
+@instrument.stage()
+def extract(circuit, key_idx, key_val, cs_idx, cs_val, extracted, comp_result, k, gray_code=False):
+    image_size = 2**len(cs_idx)
+    # copy the k low bits of the stego value, qubit 0 the least significant
     for i in range(k):
-        circuit.cx(cs_val[len(cs_val) - k - 1 + i], extracted[i])
+        circuit.cx(cs_val[i], extracted[i])
 
     coordinate_comparator(circuit, comp_result, key_idx, cs_idx)
 
-    for i in range(image_size):
-        bin_ind = bin(i)[2:]
-        bin_ind = (len(key_idx) - len(bin_ind)) * '0' + bin_ind
-        bin_ind = bin_ind[::-1]
-
-        # X-gate (enabling zero-controlled nature)
-        for j in range(len(bin_ind)):
-            if bin_ind[j] == '0':
-                circuit.x(cs_idx[j])
-
-        circuit.mcx(comp_result[:] + cs_idx[:], extracted)
+    # where the key is 0 the inverse secret was embedded: flip it back
+    circuit.x(key_val)
+    def flip(i):
+        for bit in extracted[:k]:
+            circuit.mcx(comp_result[:] + key_val[:] + cs_idx[:], bit)
+
+    if gray_code:
+        neqr.walk_indices(circuit, cs_idx, neqr.gray_code_order(image_size), flip)
+    else:
+        for i in range(image_size):
+            bin_ind = bin(i)[2:]
+            bin_ind = (len(key_idx) - len(bin_ind)) * '0' + bin_ind
+            bin_ind = bin_ind[::-1]
+
+            # X-gate (enabling zero-controlled nature)
+            for j in range(len(bin_ind)):
+                if bin_ind[j] == '0':
+                    circuit.x(cs_idx[j])
+
+            flip(i)
         
-        # X-gate (enabling zero-controlled nature)
-        for j in range(len(bin_ind)):
-            if bin_ind[j] == '0':
-                circuit.x(cs_idx[j])
+            # X-gate (enabling zero-controlled nature)
+            for j in range(len(bin_ind)):
+                if bin_ind[j] == '0':
+                    circuit.x(cs_idx[j])
+
+    circuit.x(key_val)
 
@@ -0,0 +1,121 @@
+'''
+Reusable instructions for the steganography building blocks. Each template
+is built once per register width, cached, and appended to circuits by
+reference, so building many circuits of the same size costs a cache lookup
+instead of re-appending every gate. Scratch qubits that the builders would
+allocate with add_register become trailing qubits of the template; the
+append_* helpers allocate them as a single ancilla register.
+'''
+from functools import lru_cache
+
+from qiskit import QuantumCircuit, QuantumRegister, AncillaRegister
+
+import arithmetic
+
+# number of templates kept per builder before the least recently used is evicted
+TEMPLATE_CACHE_SIZE = 32
+
+
+'''
+params
+---------------
+width: size of regY and regX
+
+return
+---------------
+an instruction on |Y>|X>|ancilla> (2*width ancillas) doing comparator_core
+'''
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def comparator_core_template(width):
+    regY, regX = QuantumRegister(width, 'y'), QuantumRegister(width, 'x')
+    ancilla = AncillaRegister(2*width, 'ancilla')
+    circuit = QuantumCircuit(regY, regX, ancilla, name=f'comparator_core_{width}')
+    arithmetic.comparator_core(circuit, regY, regX, ancilla)
+    return circuit.to_instruction()
+
+
+'''
+params
+---------------
+width: size of regY and regX
+
+return
+---------------
+an instruction on |Y>|X>|result>|ancilla> doing comparator
+'''
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def comparator_template(width):
+    regY, regX = QuantumRegister(width, 'y'), QuantumRegister(width, 'x')
+    result = QuantumRegister(2, 'result')
+    circuit = QuantumCircuit(regY, regX, result, name=f'comparator_{width}')
+    arithmetic.comparator(regY, regX, circuit, result)
+    return circuit.to_instruction()
+
+
+'''
+params
+---------------
+width: size of Y and X
+barriers: passed to difference
+
+return
+---------------
+an instruction on |Y>|X>|difference>|ancilla> doing difference
+'''
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def difference_template(width, barriers=True):
+    Y, X = QuantumRegister(width, 'y'), QuantumRegister(width, 'x')
+    diff = QuantumRegister(width, 'difference')
+    circuit = QuantumCircuit(Y, X, diff, name=f'difference_{width}')
+    arithmetic.difference(circuit, Y, X, diff, barriers=barriers)
+    return circuit.to_instruction()
+
+
+'''
+params
+---------------
+circuit: the circuit to append to
+template: an instruction from this module
+qubits: the qubits the template acts on, without its scratch ancillas
+
+return
+---------------
+the ancilla register allocated for the template's scratch qubits, or None
+'''
+def append_template(circuit, template, qubits):
+    qubits = list(qubits)
+    ancilla = None
+    if template.num_qubits > len(qubits):
+        ancilla = AncillaRegister(template.num_qubits - len(qubits))
+        circuit.add_register(ancilla)
+        qubits += ancilla[:]
+    circuit.append(template, qubits)
+    return ancilla
+
+
+def append_comparator(circuit, regY, regX, result):
+    return append_template(circuit, comparator_template(len(regX)), regY[:] + regX[:] + result[:])
+
+
+def append_difference(circuit, Y, X, difference, barriers=True):
+    assert len(Y) == len(X)
+    return append_template(circuit, difference_template(len(X), barriers), Y[:] + X[:] + difference[:])
+
+
+_TEMPLATES = [comparator_core_template,
+              comparator_template,
+              difference_template]
+
+
+'''
+return
+---------------
+the lru_cache statistics (hits, misses, maxsize, currsize) of every template
+'''
+def template_cache_info():
+    return {template.__name__: template.cache_info() for template in _TEMPLATES}
+
+
+def clear_template_cache():
+    for template in _TEMPLATES:
+        template.cache_clear()
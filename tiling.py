@@ -0,0 +1,174 @@
+'''
+Tiling front-end for large or non-power-of-two images. An image is padded
+and split into fixed power-of-two tiles, each tile is encoded (or embedded)
+as its own small circuit in a process pool, and the per-tile results are
+reassembled. The qubit count depends only on the tile size, never on the
+image size.
+'''
+import math
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from qiskit import QuantumCircuit, QuantumRegister
+
+import batch
+import fastsim
+import neqr
+import steganography
+
+
+'''
+params
+---------------
+image: 2d array of any shape
+tile_size: side length of the square tiles, a power of 2
+
+return
+---------------
+a (tile_rows, tile_cols, tile_size, tile_size) array of tiles; the image is
+zero padded on the bottom and right to a multiple of tile_size
+'''
+def split_tiles(image, tile_size):
+    assert tile_size > 0 and tile_size & (tile_size - 1) == 0
+    image = np.asarray(image)
+    rows, cols = image.shape
+    padded = np.pad(image, ((0, -rows % tile_size), (0, -cols % tile_size)))
+    tile_rows, tile_cols = padded.shape[0] // tile_size, padded.shape[1] // tile_size
+    return padded.reshape(tile_rows, tile_size, tile_cols, tile_size).swapaxes(1, 2)
+
+
+'''
+params
+---------------
+tiles: array from split_tiles, or per-tile results of the same layout
+shape: (rows, cols) of the original image
+
+return
+---------------
+the reassembled image with the padding cropped off
+'''
+def merge_tiles(tiles, shape):
+    tiles = np.asarray(tiles)
+    tile_rows, tile_cols, tile_size, _ = tiles.shape
+    image = tiles.swapaxes(1, 2).reshape(tile_rows * tile_size, tile_cols * tile_size)
+    return image[:shape[0], :shape[1]]
+
+
+def _call(func, args):
+    return func(*args)
+
+
+'''
+params
+---------------
+func: a picklable module-level function taking one tile of each image and
+returning one tile-shaped array, or a tuple of them
+images: the images to tile, all of the same shape
+tile_size: side length of the tiles
+max_workers: process pool size, defaults to the number of cores
+
+return
+---------------
+func's results merged back into full images (a tuple if func returns one)
+'''
+def map_tiles(func, images, tile_size, max_workers=None):
+    shape = np.shape(images[0])
+    tiled = [split_tiles(image, tile_size) for image in images]
+    tile_rows, tile_cols = tiled[0].shape[:2]
+    args = [tuple(tiles[r, c] for tiles in tiled) for r in range(tile_rows) for c in range(tile_cols)]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(partial(_call, func), args))
+
+    def merge(parts):
+        return merge_tiles(np.reshape(parts, (tile_rows, tile_cols, tile_size, tile_size)), shape)
+
+    if isinstance(results[0], tuple):
+        return tuple(merge([result[i] for result in results]) for i in range(len(results[0])))
+    return merge(results)
+
+
+'''
+params
+---------------
+image: 2d array of 8-bit grayscale values, any shape
+tile_size: side length of the tiles
+max_workers: process pool size
+
+return
+---------------
+the transpiled NEQR circuits of the tiles in row-major tile order, each on
+2*log2(tile_size) + 8 qubits
+'''
+def neqr_tiles(image, tile_size, max_workers=None):
+    tiles = split_tiles(image, tile_size)
+    return batch.build_batch(batch.build_neqr_circuit, tiles.reshape(-1, tile_size, tile_size), max_workers=max_workers)
+
+
+# encode one tile with NEQR and read it back with the branch simulator
+def _neqr_roundtrip_tile(tile):
+    circuit = batch.build_neqr_circuit(tile)
+    idx, intensity = circuit.qregs[1], circuit.qregs[0]
+    bits = fastsim.simulate(circuit)
+    decoded = np.zeros(tile.size, dtype=np.uint8)
+    decoded[fastsim.register_values(circuit, bits, idx)] = fastsim.register_values(circuit, bits, intensity)
+    return decoded.reshape(tile.shape)
+
+
+'''
+params
+---------------
+image: 2d array of 8-bit grayscale values, any shape
+tile_size: side length of the tiles
+max_workers: process pool size
+
+return
+---------------
+the image decoded back from the per-tile NEQR circuits, for verifying the
+encoding of images too large for a single circuit
+'''
+def neqr_roundtrip(image, tile_size, max_workers=None):
+    return map_tiles(_neqr_roundtrip_tile, [image], tile_size, max_workers)
+
+
+# embed one tile with the circuit pipeline (NEQR images, then
+# steganography.embed) and read the stego and key values back with the
+# branch simulator, from the branches where all three positions agree
+def _embed_tile(cover, secret, k):
+    n = int(math.log2(cover.size))
+    C, S, Key = QuantumRegister(n, 'C'), QuantumRegister(n, 'S'), QuantumRegister(n, 'Key')
+    cover_val, secret_val, key_i = QuantumRegister(8, 'cover'), QuantumRegister(k, 'secret'), QuantumRegister(1, 'key_i')
+    circuit = QuantumCircuit(cover_val, C, secret_val, S, Key, key_i)
+    neqr.neqr(neqr.convert_to_bit_array(cover), circuit, C, cover_val, barriers=False)
+    neqr.neqr(neqr.convert_to_bit_array(secret, bit_depth=k), circuit, S, secret_val, barriers=False)
+    circuit.h(Key)
+    steganography.embed(circuit, C, S, Key, cover_val, secret_val, key_i)
+
+    bits = fastsim.simulate(circuit)
+    pixel = fastsim.register_values(circuit, bits, C)
+    keyed = (pixel == fastsim.register_values(circuit, bits, S)) & (pixel == fastsim.register_values(circuit, bits, Key))
+    stego, key = np.zeros(cover.size, dtype=np.uint8), np.zeros(cover.size, dtype=np.uint8)
+    stego[pixel[keyed]] = fastsim.register_values(circuit, bits, cover_val)[keyed]
+    key[pixel[keyed]] = fastsim.register_values(circuit, bits, key_i)[keyed]
+    return stego.reshape(cover.shape), key.reshape(cover.shape)
+
+
+'''
+params
+---------------
+cover: 2d array of 8-bit cover values, any shape
+secret: k-bit secret values, same shape as cover
+k: number of bits per secret pixel
+tile_size: side length of the tiles
+kernel: per-tile embedding, called as kernel(cover_tile, secret_tile, k)
+and returning (stego_tile, key_tile); by default every tile runs through
+the embed circuit on the branch simulator, reference.embed is the
+classical path
+max_workers: process pool size
+
+return
+---------------
+(stego, key) for the whole image
+'''
+def embed_tiles(cover, secret, k, tile_size, kernel=_embed_tile, max_workers=None):
+    return map_tiles(partial(kernel, k=k), [cover, secret], tile_size, max_workers)
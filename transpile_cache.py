@@ -0,0 +1,231 @@
+'''
+On-disk cache of transpiled circuits. Circuits are keyed by a hash of their
+structure (gates, parameters, conditions, the definitions of non-standard
+gates and the qubits/clbits they act on, by index) together with the
+backend and transpiler settings, so rebuilding the same NEQR or embedding
+circuit reuses the compiled result instead of running the transpiler again.
+Entries are stored as QPY files and the least recently used ones are
+evicted once the cache exceeds its size bound.
+'''
+import hashlib
+import io
+import os
+import tempfile
+
+from qiskit import QuantumCircuit, QuantumRegister, AncillaRegister
+from qiskit import qpy
+from qiskit.circuit import Clbit
+from qiskit.circuit.library.standard_gates import get_standard_gate_name_mapping
+from qiskit.compiler import transpile
+
+# default bound on the total size of the cached QPY files
+CACHE_MAX_BYTES = 256 * 2**20
+
+# gates whose name fixes their definition
+_STANDARD_GATES = set(get_standard_gate_name_mapping())
+
+
+def _condition(instruction, clbit_index):
+    condition = getattr(instruction, 'condition', None)
+    if condition is None:
+        return None
+    target, value = condition
+    if isinstance(target, Clbit):
+        return ('clbit', clbit_index[target], value)
+    return ('creg', [clbit_index[clbit] for clbit in target], value)
+
+
+def _describe(instruction):
+    base = getattr(instruction, 'base_gate', None)
+    return repr((type(instruction).__qualname__, instruction.name, instruction.num_qubits, instruction.num_clbits,
+                 [str(param) for param in instruction.params],
+                 None if base is None else (base.name, [str(param) for param in base.params]),
+                 sorted((k, v) for k, v in vars(instruction).items() if isinstance(v, (bool, int, float, str)))))
+
+
+'''
+params
+---------------
+circuit: a quantum circuit
+
+return
+---------------
+a hex digest that is equal for circuits with the same registers and the
+same instructions on the same qubit and clbit positions; conditions and the
+definitions of gates outside the standard library (e.g. clean and dirty
+mcx_vchain) are part of the instructions
+'''
+def structural_hash(circuit, _definitions=None):
+    # definition hashes of custom gates, by gate object: templates append one
+    # shared gate many times
+    definitions = {} if _definitions is None else _definitions
+    digest = hashlib.sha256()
+    qubit_index = {qubit: i for i, qubit in enumerate(circuit.qubits)}
+    clbit_index = {clbit: i for i, clbit in enumerate(circuit.clbits)}
+    digest.update(repr(([reg.size for reg in circuit.qregs],
+                        [reg.size for reg in circuit.cregs],
+                        str(circuit.global_phase))).encode())
+    for instruction, qargs, cargs in circuit.data:
+        definition = None
+        if instruction.name not in _STANDARD_GATES:
+            if type(instruction).__module__.startswith('qiskit.circuit.library.'):
+                # library gates are fixed by their class and settings (e.g.
+                # MCXVChain's dirty_ancillas); their definitions can be huge
+                definition = _describe(instruction)
+            else:
+                if id(instruction) not in definitions:
+                    definitions[id(instruction)] = (None if instruction.definition is None
+                                                    else structural_hash(instruction.definition, definitions))
+                definition = definitions[id(instruction)]
+        digest.update(repr((instruction.name,
+                            instruction.num_qubits,
+                            [str(param) for param in instruction.params],
+                            getattr(instruction, 'ctrl_state', None),
+                            _condition(instruction, clbit_index),
+                            definition,
+                            [qubit_index[qubit] for qubit in qargs],
+                            [clbit_index[clbit] for clbit in cargs])).encode())
+    return digest.hexdigest()
+
+
+'''
+params
+---------------
+circuit: a quantum circuit
+
+return
+---------------
+the circuit with its AncillaRegisters replaced by quantum registers of the
+same name and size (the circuit itself when it has none); QPY in this
+qiskit writes AncillaRegisters but cannot read them back
+'''
+def plain_registers(circuit):
+    if not any(isinstance(reg, AncillaRegister) for reg in circuit.qregs):
+        return circuit
+    qregs = [QuantumRegister(reg.size, reg.name) if isinstance(reg, AncillaRegister) else reg for reg in circuit.qregs]
+    bits = {old: new for reg, plain in zip(circuit.qregs, qregs) for old, new in zip(reg, plain)}
+    plain = QuantumCircuit(*qregs, *circuit.cregs, name=circuit.name, global_phase=circuit.global_phase,
+                           metadata=circuit.metadata)
+    plain.compose(circuit, qubits=[bits[bit] for bit in circuit.qubits], inplace=True)
+    return plain
+
+
+'''
+params
+---------------
+path: file to write
+data: bytes to write
+
+return
+---------------
+nothing; data is written to a temporary file in the same directory first,
+so concurrent readers never see a partial entry
+'''
+def write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+'''
+params
+---------------
+directory: a cache directory
+suffix: extension of its entries
+
+return
+---------------
+(mtime, size, path) of every entry, least recently used first
+'''
+def disk_entries(directory, suffix):
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(suffix)]
+    return sorted((os.stat(path).st_mtime, os.stat(path).st_size, path) for path in paths)
+
+
+'''
+params
+---------------
+directory, suffix: as for disk_entries
+max_bytes: total size to evict down to
+
+return
+---------------
+nothing; the least recently used entries are removed until the rest fit
+'''
+def evict(directory, suffix, max_bytes):
+    entries = disk_entries(directory, suffix)
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+'''
+params
+---------------
+directory: where the QPY files are kept, created if missing
+max_bytes: total size of cached files before least recently used entries
+are evicted
+'''
+class TranspileCache:
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, circuit, backend, optimization_level, **transpile_options):
+        name = backend.name() if callable(backend.name) else backend.name
+        method = getattr(backend.options, 'method', None)
+        settings = repr((name, method, optimization_level, sorted(transpile_options.items())))
+        return hashlib.sha256((structural_hash(circuit) + settings).encode()).hexdigest()
+
+    '''
+    params
+    ---------------
+    circuit: the circuit to transpile
+    backend: the backend to transpile for
+    optimization_level: transpiler optimization level
+    transpile_options: any other transpile arguments, part of the key
+
+    return
+    ---------------
+    the transpiled circuit, loaded from the cache when an equal circuit was
+    transpiled before with the same settings; AncillaRegisters come back as
+    plain quantum registers (see plain_registers), whether cached or not
+    '''
+    def transpile(self, circuit, backend, optimization_level=1, **transpile_options):
+        path = os.path.join(self.directory, self.key(circuit, backend, optimization_level, **transpile_options) + '.qpy')
+        if os.path.exists(path):
+            self.hits += 1
+            os.utime(path)
+            with open(path, 'rb') as f:
+                return qpy.load(f)[0]
+
+        self.misses += 1
+        compiled = plain_registers(transpile(circuit, backend=backend, optimization_level=optimization_level, **transpile_options))
+        buffer = io.BytesIO()
+        qpy.dump(compiled, buffer)
+        write_atomic(path, buffer.getvalue())
+        evict(self.directory, '.qpy', self.max_bytes)
+        return compiled
+
+    '''
+    return
+    ---------------
+    hit and miss counters, and the number and total size of cached entries
+    '''
+    def stats(self):
+        entries = disk_entries(self.directory, '.qpy')
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries)}
+
+    def clear(self):
+        for _, _, path in disk_entries(self.directory, '.qpy'):
+            os.remove(path)
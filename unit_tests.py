@@ -1,12 +1,30 @@
 from qiskit import QuantumCircuit, ClassicalRegister, QuantumRegister, AncillaRegister
 from qiskit import execute
 from qiskit import Aer
-from qiskit import IBMQ
 from qiskit.compiler import transpile
 
+import ancilla
+import backends
+import batch
+import benchmark
+import fastsim
+import instrument
+import mcx
 import neqr
+import numpy as np
+import peephole
 import random
+import readout
+import resources
+import result_cache
+import reference
+import sampling
 import steganography
+import templates
+import tempfile
+import tiling
+import time
+import transpile_cache
 
 
 def arraynxn(n):
@@ -21,6 +39,14 @@ def convert_to_bits_test():
     bits_arr = neqr.convert_to_bits(array2x2)
     print(bits_arr)
 
+def convert_to_bit_array_test():
+    test_arr = [[random.randint(0, 15) for i in range(6)] for j in range(3)]
+    print(test_arr)
+    bits_arr = neqr.convert_to_bit_array(test_arr, bit_depth=4)
+    print(bits_arr)
+    blocks = list(neqr.iter_bit_blocks(test_arr, block_rows=2, bit_depth=4))
+    print(f'blocks match: {(np.concatenate(blocks) == bits_arr).all()}')
+
 def neqr_test():
     testarr = arraynxn(4)
     print('test array:')
@@ -39,11 +65,96 @@ def neqr_test():
     job = execute(result_circuit, backend=backend, shots=1, memory=True)
     job_result = job.result()
     statevec = job_result.get_statevector(result_circuit)
-    for i in range(len(statevec)):
-        if statevec[i] != 0:
-            print(f"{format(i, '012b')}: {statevec[i].real}")
+    indices, amplitudes = readout.nonzero_states(statevec)
+    for i, amplitude in zip(indices, amplitudes):
+        print(f"{format(i, '012b')}: {amplitude.real}")
+    print(readout.decode_neqr(statevec, result_circuit, idx, intensity))
     print(result_circuit)
 
+def build_neqr_test():
+    testarr = arraynxn(4)
+    idx = QuantumRegister(4)
+    intensity = QuantumRegister(8)
+    key = QuantumRegister(1)
+    sub_circuit = neqr.build_neqr(neqr.convert_to_bits(testarr), idx, intensity)
+    result_circuit = QuantumCircuit(key, intensity, idx)
+    result_circuit.compose(sub_circuit, qubits=sub_circuit.qubits, inplace=True)
+
+    backend = Aer.get_backend('statevector_simulator')
+    statevec = execute(result_circuit, backend=backend, shots=1).result().get_statevector(result_circuit)
+    print(f'image matches: {(readout.decode_neqr(statevec, result_circuit, idx, intensity) == testarr).all()}')
+
+def neqr_gray_test():
+    testarr = arraynxn(4)
+    testarr[0][1] = 0
+    flattened_array = neqr.convert_to_bits(testarr)
+
+    backend = Aer.get_backend('statevector_simulator')
+    statevecs = []
+    for builder in [neqr.neqr, neqr.neqr_gray]:
+        idx = QuantumRegister(4)
+        intensity = QuantumRegister(8)
+        result_circuit = QuantumCircuit(intensity, idx)
+        builder(flattened_array, result_circuit, idx, intensity)
+        print(f'{builder.__name__}: {dict(result_circuit.count_ops())}')
+        job = execute(result_circuit, backend=backend, shots=1, memory=True)
+        statevecs.append(job.result().get_statevector(result_circuit))
+    print(f'same state: {np.allclose(statevecs[0], statevecs[1])}')
+
+def neqr_frames_test():
+    frames = [np.array(arraynxn(4))]
+    for i in range(3):
+        frame = frames[-1].copy()
+        frame[random.randrange(4)][random.randrange(4)] = random.randint(0, 255)
+        frames.append(frame)
+
+    idx = QuantumRegister(4)
+    intensity = QuantumRegister(8)
+    backend = Aer.get_backend('statevector_simulator')
+    result_circuit = QuantumCircuit(intensity, idx)
+    for (circuit, info), frame in zip(neqr.neqr_frames(iter(frames), idx, intensity), frames):
+        # the delta circuits are applied on top of the previous frames
+        result_circuit.compose(circuit, qubits=circuit.qubits, inplace=True)
+        statevec = execute(result_circuit, backend=backend, shots=1).result().get_statevector()
+        decoded = readout.decode_neqr(statevec, result_circuit, idx, intensity)
+        print(f'{info} matches: {(decoded == frame).all()}')
+
+def neqr_compressed_test():
+    # large uniform regions compress well
+    testarr = [[255 if j < 2 else random.randint(0, 255) for i in range(4)] for j in range(4)]
+    flattened_array = neqr.convert_to_bits(testarr)
+
+    idx = QuantumRegister(4)
+    intensity = QuantumRegister(8)
+    result_circuit = QuantumCircuit(intensity, idx)
+    report = neqr.neqr_compressed(flattened_array, result_circuit, idx, intensity)
+    for plane, stats in report.items():
+        print(f'plane {plane}: {stats}')
+
+    backend = Aer.get_backend('statevector_simulator')
+    job = execute(result_circuit, backend=backend, shots=1, memory=True)
+    statevec = job.result().get_statevector(result_circuit)
+    print(readout.decode_neqr(statevec, result_circuit, idx, intensity))
+
+def neqr_counts_test():
+    testarr = arraynxn(4)
+    print(testarr)
+    circuit = batch.build_neqr_circuit(testarr)
+    intensity, idx = circuit.qregs
+
+    simulator = Aer.get_backend('aer_simulator')
+    for shots in [16, readout.neqr_shots(16, confidence=0.99)]:
+        counts = execute(circuit, simulator, shots=shots).result().get_counts(circuit)
+        image, seen = readout.decode_neqr_counts(counts, circuit, idx, intensity)
+        print(f'shots: {shots}, expected coverage: {readout.expected_coverage(16, shots):.3f}, seen: {seen.mean():.3f}')
+        print(f'seen pixels correct: {(image[seen] == np.array(testarr)[seen]).all()}')
+
+    # a rare misread listed ahead of every true outcome loses to it
+    flip = lambda state: ('1' if state[0] == '0' else '0') + state[1:]
+    noisy = {**{flip(state): 1 for state in counts}, **{state: 10*count for state, count in counts.items()}}
+    image, seen = readout.decode_neqr_counts(noisy, circuit, idx, intensity)
+    print(f'most frequent kept: {(image[seen] == np.array(testarr)[seen]).all()}')
+
 ############################################################################################################################
 
 '''
@@ -82,6 +193,42 @@ def comparator_test():
         print(big_endian_state)   
 
 
+def comparator_template_test():
+    simulator = Aer.get_backend('aer_simulator')
+    for trial in range(3):
+        x_val, y_val = random.randint(0, 15), random.randint(0, 15)
+        outputs = []
+        for build in [steganography.comparator, templates.append_comparator]:
+            regX = QuantumRegister(4)
+            regY = QuantumRegister(4)
+            result = QuantumRegister(2)
+            cr = ClassicalRegister(2)
+            circuit = QuantumCircuit(regX, regY, result, cr)
+            for i in range(4):
+                if (x_val >> i) & 1:
+                    circuit.x(regX[i])
+                if (y_val >> i) & 1:
+                    circuit.x(regY[i])
+            if build is steganography.comparator:
+                build(regY, regX, circuit, result)
+            else:
+                build(circuit, regY, regX, result)
+            circuit.measure(result, cr)
+            simulation = execute(circuit, simulator, shots=1, memory=True)
+            outputs.append(simulation.result().get_memory(circuit)[0])
+        print(f'Y={y_val} X={x_val}: direct {outputs[0]}, template {outputs[1]}')
+    print(templates.template_cache_info()['comparator_template'])
+
+    # key circuits for many same-size pairs look the templates up instead of
+    # appending the differences and comparator gate by gate
+    pairs = [(arraynxn(2), arraynxn(2)) for i in range(20)]
+    for use_templates in [False, True]:
+        start = time.perf_counter()
+        for pair in pairs:
+            batch.build_key_circuit(pair, use_templates=use_templates)
+        print(f'templates: {use_templates}, {len(pairs)} key circuits built in {time.perf_counter() - start:.3f}s')
+
+
 def coordinate_comparator_test():
     regXY = QuantumRegister(2)
     regAB = QuantumRegister(2)
@@ -97,10 +244,10 @@ def coordinate_comparator_test():
     simulation = execute(circuit, backend=backend, shots=1, memory=True)
     simResult = simulation.result()
     statevec = simResult.get_statevector(circuit)
-    for state in range(len(statevec)):
-        if statevec[state] != 0:
-            #note: output is in little endian
-            print(f"{format(state, '05b')}: {statevec[state].real}")
+    states, amplitudes = readout.nonzero_states(statevec)
+    for state, amplitude in zip(states, amplitudes):
+        #note: output is in little endian
+        print(f"{format(state, '05b')}: {amplitude.real}")
 
 def difference_test():
     regY = QuantumRegister(4, "regY")
@@ -121,9 +268,81 @@ def difference_test():
     result = simulation.result()
     counts = result.get_counts(circuit)
 
-    for(state, count) in counts.items():
-        big_endian_state = state[::-1]
-        print(big_endian_state)
+    layout = readout.RegisterLayout(circuit)
+    decoded = layout.decode_counts(counts, ['measurement'])
+    print(f"difference: {decoded['measurement']}")
+
+
+def peephole_test():
+    testarr = arraynxn(4)
+    flattened_array = neqr.convert_to_bits(testarr)
+    backend = Aer.get_backend('statevector_simulator')
+    statevecs = []
+    for barriers in [True, False]:
+        idx = QuantumRegister(4)
+        intensity = QuantumRegister(8)
+        result_circuit = QuantumCircuit(intensity, idx)
+        neqr.neqr(flattened_array, result_circuit, idx, intensity, barriers=barriers)
+        optimized, report = peephole.optimize(result_circuit)
+        print(f'barriers={barriers}: {report}')
+        statevecs.append(execute(optimized, backend=backend, shots=1).result().get_statevector())
+    print(f'same state: {np.allclose(statevecs[0], statevecs[1])}')
+
+    Y, X, D = QuantumRegister(8), QuantumRegister(8), QuantumRegister(8)
+    circuit = QuantumCircuit(Y, X, D)
+    steganography.difference(circuit, Y, X, D, barriers=False)
+    print(f'difference: {peephole.optimize(circuit)[1]}')
+
+
+def ancilla_pool_test():
+    for use_pool in [False, True]:
+        control = QuantumRegister(1)
+        regY = QuantumRegister(4, "regY")
+        regX = QuantumRegister(4, "regX")
+        diff1 = QuantumRegister(4, 'diff1')
+        diff2 = QuantumRegister(4, 'diff2')
+        result = QuantumRegister(2, 'result')
+        circuit = QuantumCircuit(control, regY, regX, diff1, diff2, result)
+        pool = ancilla.AncillaPool(circuit) if use_pool else None
+
+        steganography.controlled_difference(control[0], circuit, regY, regX, diff1, pool=pool)
+        steganography.difference(circuit, regY, regX, diff2, pool=pool)
+        steganography.comparator(diff1, diff2, circuit, result, pool=pool)
+
+        print(f'pooled: {use_pool}, qubits: {circuit.num_qubits}')
+        if use_pool:
+            print(pool.report())
+
+
+def fastsim_test():
+    # NEQR round trip through the branch simulator
+    testarr = arraynxn(4)
+    idx = QuantumRegister(4)
+    intensity = QuantumRegister(8)
+    circuit = QuantumCircuit(intensity, idx)
+    neqr.neqr_gray(neqr.convert_to_bits(testarr), circuit, idx, intensity)
+    bits = fastsim.simulate(circuit)
+    decoded = np.zeros(16, dtype=int)
+    decoded[fastsim.register_values(circuit, bits, idx)] = fastsim.register_values(circuit, bits, intensity)
+    print(f'decoded matches: {(decoded.reshape(4, 4) == np.array(testarr)).all()}')
+
+    # difference on a basis state, against the Aer simulator
+    regY = QuantumRegister(4, "regY")
+    regX = QuantumRegister(4, "regX")
+    difference = QuantumRegister(4, 'difference')
+    circuit = QuantumCircuit(regY, regX, difference)
+    circuit.x(regY[0])
+    circuit.x(regX[2])
+    steganography.difference(circuit, regY, regX, difference)
+    bits = fastsim.simulate(circuit)
+    print(f'fastsim difference: {fastsim.register_values(circuit, bits, difference)}')
+
+    cr = ClassicalRegister(4)
+    circuit.add_register(cr)
+    circuit.measure(difference, cr)
+    simulator = Aer.get_backend('aer_simulator')
+    counts = execute(circuit, simulator, shots=1).result().get_counts(circuit)
+    print(f'aer difference: {[int(state, 2) for state in counts]}')
 
 
 def get_secret_image_test():
@@ -132,6 +351,25 @@ def get_secret_image_test():
     for a in test_arr:
         print(a)
     print(f'result:\n {test_result}')
+    expected = [[int(''.join(str(a[j][l]) for a in test_arr), 2) for l in range(4)] for j in range(4)]
+    print(f'values match: {(test_result == expected).all()}')
+
+    # packed straight into the NEQR bit planes, no string round-trip
+    bits = steganography.get_secret_bits(5, test_arr)
+    print(f'bits match: {(bits == neqr.convert_to_bit_array(test_result, bit_depth=5)).all()}')
+    idx = QuantumRegister(4)
+    intensity = QuantumRegister(5)
+    result_circuit = QuantumCircuit(intensity, idx)
+    neqr.neqr(bits, result_circuit, idx, intensity)
+    backend = Aer.get_backend('statevector_simulator')
+    statevec = execute(result_circuit, backend=backend, shots=1).result().get_statevector()
+    print(f'encoded: {(readout.decode_neqr(statevec, result_circuit, idx, intensity) == test_result).all()}')
+
+    # a batch of non-square secret images
+    batch_arr = np.random.randint(0, 2, size=(3, 10, 2, 6))
+    print(f'batch: {steganography.get_secret_image(10, batch_arr).shape} {steganography.get_secret_image(10, batch_arr).dtype}')
+    batch_bits = steganography.get_secret_bits(10, batch_arr)
+    print(f'batch bits: {batch_bits.shape} match: {all((batch_bits[b] == steganography.get_secret_bits(10, batch_arr[b])).all() for b in range(3))}')
 
 
 def invert_test():
@@ -150,11 +388,11 @@ def invert_test():
     simulation = execute(circuit, backend=backend, shots=1, memory=True)
     simResult = simulation.result()
     statevec = simResult.get_statevector(circuit)
-    for state in range(len(statevec)):
-        if statevec[state] != 0:
-            #note: output is in little endian
-            #only have to look at first bit 
-            print(f"{format(state, '012b')}: {statevec[state].real}")
+    states, amplitudes = readout.nonzero_states(statevec)
+    for state, amplitude in zip(states, amplitudes):
+        #note: output is in little endian
+        #only have to look at first bit 
+        print(f"{format(state, '012b')}: {amplitude.real}")
 
 
 def get_key_test():
@@ -187,18 +425,233 @@ def get_key_test():
 
     circuit.measure(key_result[:] + key_idx[:], key_mes)
 
-    provider = IBMQ.load_account()
-    
-    simulator = provider.get_backend('simulator_mps')
-    simulation = execute(circuit, simulator, shots=1024)
-    result = simulation.result()
-    counts = result.get_counts(circuit)
+    # wide but shallow in entanglement: runs locally on the MPS method, with
+    # only as many shots as it takes to decide every key bit
+    readout_result = sampling.sample(circuit, key_idx, key_result)
+    print(f"key: {readout_result['values']}")
+    print(f"decided: {readout_result['decided']}")
+    print(f"mixed: {readout_result['mixed']}")
+    print(f"shots used: {readout_result['shots']} in {readout_result['chunks']} runs")
+
+
+def backend_selection_test():
+    image = batch.build_neqr_circuit(arraynxn(2))
+    key = batch.build_key_circuit((arraynxn(2), arraynxn(2)))
+    for circuit in (image, key):
+        simulator = backends.select_backend(circuit)
+        print(f'{circuit.num_qubits} qubits, entanglement estimate {backends.estimate_entanglement(circuit)}: {simulator.options.method}')
+    counts = backends.run(image, shots=256).get_counts()
+    for(state, count) in counts.items():
+        big_endian_state = state[::-1]
+        print(f"Measured {big_endian_state} {count} times.")
+
+
+def mcx_lowering_test():
+    idx, intensity, spare = QuantumRegister(4), QuantumRegister(8), QuantumRegister(2)
+    circuit = QuantumCircuit(intensity, idx, spare)
+    neqr.neqr(neqr.convert_to_bits(arraynxn(4)), circuit, idx, intensity)
+    lowered, report = mcx.lower_with_report(circuit)
+    print(f'modes: {set(site["mode"] for site in report["sites"])}')
+    print(f'before: {report["before"]} after: {report["after"]}')
+
+    backend = Aer.get_backend('statevector_simulator')
+    statevecs = [execute(qc, backend=backend, shots=1).result().get_statevector() for qc in [circuit, lowered]]
+    print(f'same state: {np.allclose(statevecs[0], statevecs[1])}')
+
+
+def batch_test():
+    images = [arraynxn(2) for i in range(8)]
+    circuits = batch.build_batch(batch.build_neqr_circuit, images, max_workers=4)
+    counts = batch.run_batch(circuits, shots=256)
+    for image, image_counts in zip(images, counts):
+        print(image)
+        for (state, count) in image_counts.items():
+            big_endian_state = state[::-1]
+            print(f"Measured {big_endian_state} {count} times.")
+
+
+def parameterized_batch_test():
+    images = [arraynxn(2) for i in range(4)] + [arraynxn(4) for i in range(2)]
+    counts = batch.run_parameterized_batch(images, shots=512)
+    reference_counts = batch.run_batch([transpile(batch.build_neqr_circuit(image)) for image in images], shots=512)
+    for image, image_counts, expected in zip(images, counts, reference_counts):
+        print(image)
+        print(f'same states as neqr: {sorted(image_counts) == sorted(expected)}')
 
+
+def transpile_cache_test():
+    cache = transpile_cache.TranspileCache(tempfile.mkdtemp())
+    simulator = Aer.get_backend('aer_simulator')
+    image = arraynxn(2)
+    for i in range(3):
+        circuit = batch.build_neqr_circuit(image)
+        compiled = cache.transpile(circuit, simulator)
+    print(cache.stats())
+
+    # key circuits hold AncillaRegisters, which QPY cannot read back as such
+    pair = (arraynxn(2), arraynxn(2))
+    for i in range(2):
+        cache.transpile(batch.build_key_circuit(pair), simulator)
+    print(cache.stats())
+    counts = execute(compiled, simulator, shots=256).result().get_counts()
     for(state, count) in counts.items():
         big_endian_state = state[::-1]
         print(f"Measured {big_endian_state} {count} times.")
 
 
+def result_cache_test():
+    directory = tempfile.mkdtemp()
+    cache = result_cache.ResultCache(directory)
+    cover, secrets = arraynxn(2), [np.random.randint(0, 4, size=(2, 2)) for i in range(2)]
+    for secret in secrets + secrets:
+        circuit = cache.key_circuit(cover, secret)
+        stego, key = cache.embed(cover, secret, 2)
+        print(np.array_equal(cache.extract(stego, key, 2), secret))
+    # the cover is encoded once, each secret once, each key circuit once
+    print(cache.stats())
+
+    # a second cache on the same directory starts from the first one's entries
+    shared = result_cache.ResultCache(directory)
+    print(shared.key_circuit(cover, secrets[1]).count_ops() == circuit.count_ops())
+    print(shared.stats()['circuits'])
+
+    # numpy scalars key the same entries as the Python numbers they hold
+    print(result_cache.content_hash(cover, 2) == result_cache.content_hash(cover, np.int64(2)))
+    print(result_cache.content_hash('k', 0.5) == result_cache.content_hash('k', np.float32(0.5)))
+
+
+def tiling_test():
+    # non-power-of-two image, encoded as independent 4x4 NEQR tiles
+    test_arr = np.random.randint(0, 256, size=(6, 10))
+    decoded = tiling.neqr_roundtrip(test_arr, 4, max_workers=2)
+    print(f'decoded matches: {(decoded == test_arr).all()}')
+
+    # the transpiled tile circuits, each decoded from its statevector
+    backend = Aer.get_backend('statevector_simulator')
+    tiles = []
+    for circuit in tiling.neqr_tiles(test_arr, 4, max_workers=2):
+        circuit = circuit.remove_final_measurements(inplace=False)
+        intensity, idx = circuit.qregs
+        statevec = execute(circuit, backend=backend, shots=1).result().get_statevector()
+        tiles.append(readout.decode_neqr(statevec, circuit, idx, intensity))
+    merged = tiling.merge_tiles(np.reshape(tiles, (2, 3, 4, 4)), test_arr.shape)
+    print(f'tile circuits decode: {(merged == test_arr).all()}')
+
+    # every tile through the embed circuit
+    secret = np.random.randint(0, 4, size=(6, 10))
+    stego, key = tiling.embed_tiles(test_arr, secret, 2, 4, max_workers=2)
+    expected_stego, expected_key = reference.embed(test_arr, secret, 2)
+    print(f'embed matches reference: {(stego == expected_stego).all() and (key == expected_key).all()}')
+    print(f'secret recovered: {(reference.extract(stego, key, 2) == secret).all()}')
+
+
+def reference_test():
+    k = 3
+    covers = np.array([arraynxn(4) for i in range(5)])
+    binary_images = np.random.randint(0, 2, size=(5, k, 4, 4))
+    secrets = reference.secret_image(binary_images)
+    stego, key = reference.embed(covers, secrets, k)
+    extracted = reference.extract(stego, key, k)
+    print(f'secret recovered: {(extracted == secrets).all()}')
+    print(f'max distortion: {np.abs(stego.astype(int) - covers).max()}')
+    print(f'key:\n{key[0]}')
+
+
+def reference_circuit_test():
+    # the circuits agree with reference, branch by branch, on a 2x2 image
+    k, n = 3, 2
+    cover = np.random.randint(0, 256, size=(2, 2))
+    secret = np.random.randint(0, 2**k, size=(2, 2))
+
+    cover_idx, cover_val = QuantumRegister(n), QuantumRegister(8)
+    secret_idx, secret_val = QuantumRegister(n), QuantumRegister(k)
+    key_idx, key_result = QuantumRegister(n), QuantumRegister(1)
+    inv, diff1, diff2, comp = QuantumRegister(k), QuantumRegister(k), QuantumRegister(k), QuantumRegister(2)
+    circuit = QuantumCircuit(cover_idx, cover_val, secret_idx, secret_val, key_idx, key_result, inv, diff1, diff2, comp)
+    bits = fastsim.load_image(circuit, cover_idx, cover_val, cover)
+    bits = fastsim.load_image(circuit, secret_idx, secret_val, secret, bits)
+    steganography.invert(circuit, secret_val, inv)
+    # get_key on the cover's k low qubits
+    steganography.get_key(circuit, key_idx, key_result, cover_val[:k], secret_val, inv, diff1, diff2, comp, 2**n)
+    bits = fastsim.simulate(circuit, bits)
+    values = lambda register: fastsim.register_values(circuit, bits, register)
+    pixel = values(cover_idx)
+    same = pixel == values(secret_idx)
+    expected = reference.get_key(cover, secret, k).ravel()
+    print(f'get_key matches: {(values(key_result)[same] == expected[pixel[same]]).all()}')
+
+    C, S, Key = QuantumRegister(n), QuantumRegister(n), QuantumRegister(n)
+    cover_val, secret_val, key_i = QuantumRegister(8), QuantumRegister(k), QuantumRegister(1)
+    circuit = QuantumCircuit(C, cover_val, S, secret_val, Key, key_i)
+    bits = fastsim.load_image(circuit, C, cover_val, cover)
+    bits = fastsim.load_image(circuit, S, secret_val, secret, bits)
+    circuit.h(Key)
+    steganography.embed(circuit, C, S, Key, cover_val, secret_val, key_i)
+    bits = fastsim.simulate(circuit, bits)
+    stego, key = reference.embed(cover, secret, k)
+    pixel = values(C)
+    same = pixel == values(S)
+    keyed = same & (values(Key) == pixel)
+    print(f'embed matches: {(values(cover_val)[same] == stego.ravel()[pixel[same]]).all()}, '
+          f'key: {(values(key_i)[keyed] == key.ravel()[pixel[keyed]]).all()}')
+
+    key_idx, key_val = QuantumRegister(n), QuantumRegister(1)
+    cs_idx, cs_val = QuantumRegister(n), QuantumRegister(8)
+    extracted, comp_result = QuantumRegister(k), QuantumRegister(1)
+    circuit = QuantumCircuit(cs_idx, cs_val, key_idx, key_val, extracted, comp_result)
+    bits = fastsim.load_image(circuit, cs_idx, cs_val, stego)
+    bits = fastsim.load_image(circuit, key_idx, key_val, key, bits)
+    steganography.extract(circuit, key_idx, key_val, cs_idx, cs_val, extracted, comp_result, k)
+    bits = fastsim.simulate(circuit, bits)
+    pixel = values(cs_idx)
+    same = pixel == values(key_idx)
+    print(f'extract matches: {(values(extracted)[same] == reference.extract(stego, key, k).ravel()[pixel[same]]).all()}, '
+          f'secret recovered: {(values(extracted)[same] == secret.ravel()[pixel[same]]).all()}')
+
+
+def instrument_test():
+    with instrument.trace(depth=True) as trace:
+        circuit = batch.build_key_circuit((arraynxn(2), arraynxn(2)))
+    for path, totals in trace.summary().items():
+        print(f'{path}: {totals}')
+    top_level = sum(event['gates'] for event in trace.events() if event['level'] == 0)
+    print(f'gates accounted for: {top_level == len(circuit.data) - circuit.num_clbits}')
+
+
+def resources_test():
+    def built_counts(circuit):
+        counts = {}
+        for name, count in circuit.count_ops().items():
+            name = 'mcx' if name.startswith('mcx') else name
+            counts[name] = counts.get(name, 0) + count
+        return counts
+
+    cover, secret = arraynxn(4), arraynxn(4)
+    ones = tuple(int(neqr.convert_to_bit_array(image).sum()) for image in (cover, secret))
+    estimate = resources.key_circuit(16, ones=ones)
+    # gate by gate, so count_ops sees the templates' gates
+    circuit = batch.build_key_circuit((cover, secret), use_templates=False)
+    counts = built_counts(circuit)
+    print(f'counts match: {all(estimate[name] == counts.get(name, 0) for name in resources.GATE_KEYS)}')
+    print(f'qubits match: {estimate["qubits"] == circuit.num_qubits}')
+    print(f'depth bound holds: {estimate["depth"] >= circuit.depth()} ({estimate["depth"]} estimated, {circuit.depth()} built)')
+
+    Y, X, D = QuantumRegister(8), QuantumRegister(8), QuantumRegister(8)
+    circuit = QuantumCircuit(Y, X, D)
+    steganography.difference(circuit, Y, X, D)
+    estimate = resources.difference(8)
+    counts = built_counts(circuit)
+    print(f'difference matches: {all(estimate[name] == counts.get(name, 0) for name in resources.GATE_KEYS)}')
+    print(f'difference depth matches: {estimate["depth"] == circuit.depth()}')
+    print(resources.estimate('key_circuit', 64*64))
+
+
+def startup_test():
+    report = benchmark.startup(repeat=3)
+    print(f'import time: {report["seconds"]:.3f}s')
+    print(f'loaded eagerly: {report["loaded"]}')
+
+
 def load_test():
     idx = QuantumRegister(2)
     odx = QuantumRegister(1)